@@ -1,31 +1,35 @@
 import streamlit as st
 import uuid
+import time
 import json
-import subprocess
-import sys
 import os
 from datetime import datetime
 import re
 import html as html_lib
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 
 
 from config.settings import Settings
 from core.prompt_controller import PromptBuilder
-from core.memory import MemoryManager
+from core.memory import get_memory
 from core.assistant import JarvisAssistant
-from core.command_engine import CommandEngine
-from core.utils import is_command
+from core.command_engine import get_default_engine
+from core.render_cache import RenderCache
+from core.sandbox import get_default_pool
+from core.singleflight import get_default_flight, prompt_key
+from core.jobs import get_scheduler
+from core.summarizer import MapReduceSummarizer
+from core.attachments import get_default_store
+from core.rate_limit import BACKGROUND
 
 from core.gemini_engine import GeminiEngine
 from core.ollama_engine import OllamaEngine
 
 
 try:
-    from core.voice_engine import VoiceEngine
-    VOICE_AVAILABLE = True
+    from core.voice_engine import get_voice_engine, HAS_VOICE as VOICE_AVAILABLE
 except Exception:
-    VoiceEngine = None
+    get_voice_engine = None
     VOICE_AVAILABLE = False
 
 
@@ -40,17 +44,10 @@ def is_definition_question(text: str) -> bool:
     txt = (text or "").lower().strip()
     return any(txt.startswith(k) for k in keywords)
 
-def run_python_code_safely(code: str, timeout: int = 10) -> Dict[str, str]:
+def run_python_code_safely(code: str, timeout: int = 10,
+                           on_output: Optional[Callable[[str, str], None]] = None) -> Dict[str, str]:
     try:
-        result = subprocess.run(
-            [sys.executable, "-c", code],
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        return {"stdout": result.stdout, "stderr": result.stderr, "rc": str(result.returncode)}
-    except subprocess.TimeoutExpired:
-        return {"stdout": "", "stderr": "Execution timed out.", "rc": "-1"}
+        return get_default_pool().run(code, timeout=timeout, on_output=on_output)
     except Exception as e:
         return {"stdout": "", "stderr": f"Execution failed: {e}", "rc": "-1"}
 
@@ -73,6 +70,30 @@ def safe_highlight(content: str, query: str) -> str:
     out.append(html_lib.escape(content[last:]))
     return "".join(out).replace("\n", "<br>")
 
+def mutate_message(session_id: str, idx: int, msg_id: Optional[str],
+                   fn: Callable[[List[Dict[str, Any]], int], None]) -> bool:
+    """
+    Apply fn(session_messages, position) atomically. The message is located by id
+    when it has one, so concurrent inserts/deletes cannot shift the target.
+    """
+    def op(sess: List[Dict[str, Any]]) -> bool:
+        pos = idx
+        if msg_id is not None:
+            pos = next((i for i, m in enumerate(sess) if m.get("id") == msg_id), -1)
+        if 0 <= pos < len(sess):
+            fn(sess, pos)
+            return True
+        return False
+    return memory.update_session(session_id, op)
+
+def session_attachments(messages) -> List[Dict[str, Any]]:
+    """Attachment references from a session's user messages, newest first."""
+    refs = []
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            refs.extend(m.get("attachments") or [])
+    return refs
+
 def rerun():
     if hasattr(st, "rerun"):
         return st.rerun()
@@ -119,24 +140,59 @@ st.markdown(
 )
 
 settings = Settings()
-memory = MemoryManager(file_path=settings.history_file, max_messages=1000)  # Increased max messages
-commands = CommandEngine()
+memory = get_memory(
+    settings.history_file,
+    max_messages=1000,  # Increased max messages
+    archive_after_seconds=settings.history_archive_after_days * 24 * 3600,
+    max_hot_sessions=settings.history_max_hot_sessions,
+    max_hot_bytes=settings.history_max_hot_mb * 1024 * 1024,
+)
+attachments = get_default_store(settings.attachments_dir, max_bytes=int(settings.attachment_max_mb * 1024 * 1024))
+commands = get_default_engine()
 
 def load_engine():
     if settings.api_key:
         try:
-            return GeminiEngine(api_key=settings.api_key, model_name=settings.gemini_model_name)
+            return GeminiEngine(api_key=settings.api_key, model_name=settings.gemini_model_name,
+                                requests_per_minute=settings.gemini_requests_per_minute)
         except Exception:
             pass
     try:
-        return OllamaEngine(base_url=settings.ollama_url)
+        ollama = OllamaEngine(base_url=settings.ollama_url, num_parallel=settings.ollama_num_parallel,
+                              api=settings.ollama_api, keep_alive=settings.ollama_keep_alive or None,
+                              num_ctx=settings.ollama_num_ctx or None)
+        ollama.warm_up()
+        return ollama
     except Exception:
         return None
 
 engine = load_engine()
 engine_status = "Available" if engine else "Unavailable (set JARVIS_API_KEY or run Ollama)"
 
-voice = VoiceEngine() if VOICE_AVAILABLE else None
+voice = get_voice_engine() if VOICE_AVAILABLE else None
+
+
+def summarize_job(job: Dict[str, Any]) -> str:
+    if engine is None:
+        raise RuntimeError("No engine available for summary.")
+    # Only the conversation itself; earlier "Session summary" system messages are skipped.
+    ctx = memory.get_session(job["session_id"]).filter(roles=("user", "assistant"))
+    summary = MapReduceSummarizer(engine, priority=BACKGROUND).summarize(ctx)
+    memory.add_message(job["session_id"], "system", f"Session summary: {summary}")
+    return "Summary added to session."
+
+
+def compact_job(job: Dict[str, Any]) -> str:
+    memory.archive_idle_sessions()
+    return "Idle sessions archived."
+
+
+jobs = get_scheduler(memory)
+jobs.register("summarize", summarize_job, overwrite=True)
+jobs.register("compact", compact_job, overwrite=True)
+
+if st.session_state.get("enable_code_execution"):
+    get_default_pool()  # start warm sandbox workers before the first run click
 
 
 if "session_id" not in st.session_state:
@@ -145,12 +201,18 @@ if "pending_compose_value" not in st.session_state:
     st.session_state.pending_compose_value = ""
 if "editing_idx" not in st.session_state:
     st.session_state.editing_idx = None
+if "editing_id" not in st.session_state:
+    st.session_state.editing_id = None
 if "copied_code" not in st.session_state:
     st.session_state.copied_code = ""
 if "enable_code_execution" not in st.session_state:
     st.session_state.enable_code_execution = False
 if "enable_voice_output" not in st.session_state:
     st.session_state.enable_voice_output = False
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
+if "render_cache" not in st.session_state:
+    st.session_state.render_cache = RenderCache(highlighter=safe_highlight, max_entries=1024)
 if "quick_prompts" not in st.session_state:
     st.session_state.quick_prompts = {
         "Explain simply": "Explain {topic} in simple terms with examples.",
@@ -169,8 +231,12 @@ with st.sidebar:
     tone = st.selectbox("Tone", ["friendly", "formal", "encouraging", "humorous", "concise", "enthusiastic", "professional"])  # Added more tones
     avoid_direct_default = st.checkbox("Avoid direct answers by default", value=False)
     st.checkbox("Enable voice output (if available)", key="enable_voice_output", value=st.session_state.enable_voice_output)
+    if voice is not None and st.session_state.enable_voice_output:
+        if st.button("🔇 Stop speaking"):
+            voice.cancel()
     st.checkbox("Allow code execution (dangerous)", key="enable_code_execution", value=st.session_state.enable_code_execution)
     st.slider("Code execution timeout (seconds)", min_value=5, max_value=30, value=10, key="code_timeout")  # New: adjustable timeout
+    st.slider("Messages per page", min_value=10, max_value=200, value=25, step=5, key="page_size")
 
     st.markdown("---")
     st.markdown("### Quick prompts")
@@ -192,28 +258,32 @@ with st.sidebar:
 
     st.markdown("---")
     st.markdown("### Sessions")
-    raw = memory._load()
-    sessions = list(raw.get("sessions", {}).keys())
-    session_ids_sorted = sorted(
-        sessions,
-        key=lambda s: (raw.get("sessions", {}).get(s, [{}])[-1].get("timestamp") if raw.get("sessions", {}).get(s) else ""),
-        reverse=True
+    session_list = memory.list_sessions()
+    session_ids_sorted = [sid for sid, _, _ in session_list]
+    archived_ids = {sid for sid, _, is_archived in session_list if is_archived}
+    sel = st.selectbox(
+        "Open session",
+        options=["_new_"] + session_ids_sorted,
+        index=0,
+        format_func=lambda sid: f"{sid} 🗄️" if sid in archived_ids else sid,
     )
-    sel = st.selectbox("Open session", options=["_new_"] + session_ids_sorted, index=0)
     if sel == "_new_":
         if st.button("Create new session"):
             new_sid = str(uuid.uuid4())
             st.session_state.session_id = new_sid
+            st.session_state.history_page = 0
             memory.clear_session(new_sid)
             st.balloons()  
             rerun()
     else:
         if sel != st.session_state.session_id:
             st.session_state.session_id = sel
+            st.session_state.history_page = 0
             rerun()
 
     if st.button("Clear current session"):
         memory.clear_session(st.session_state.session_id)
+        st.session_state.history_page = 0
         st.success("Cleared session")
         rerun()
 
@@ -226,49 +296,57 @@ with st.sidebar:
         if engine is None:
             st.error("No engine available for summary.")
         else:
-            ctx = memory.get_context(st.session_state.session_id)
-            summary_prompt = "Summarize the following conversation concisely:\n" + "\n".join([f"{m['role']}: {m['content']}" for m in ctx])
-            with st.spinner("Generating summary..."):
-                try:
-                    summary = engine.generate(summary_prompt, max_tokens=200)
-                    memory.add_message(st.session_state.session_id, "system", f"Session summary: {summary}")
-                    st.success("Summary added to session.")
-                    rerun()
-                except Exception as e:
-                    st.error(f"Summary failed: {e}")
+            jobs.enqueue("summarize", st.session_state.session_id)
+            st.success("Summary queued; it will be added to the session when ready.")
+
+    if st.button("Compact history"):
+        jobs.enqueue("compact")
+        st.success("Compaction queued.")
 
 left, right = st.columns([3, 1])
 
 with left:
     st.subheader("Conversation")
-    messages = memory.get_context(st.session_state.session_id) or []
-
 
     search_text = st.text_input("Search in session", value="", key="search_text")
     role_filter = st.selectbox("Filter by role", options=["all", "user", "assistant", "system"], index=0, key="role_filter")
     show_only_pinned = st.checkbox("Only pinned", value=False, key="only_pinned")
     sort_order = st.selectbox("Sort by", ["timestamp (newest first)", "timestamp (oldest first)"], index=0)  # New: sort order
 
-    def matches_search(msg: Dict[str, Any]) -> bool:
-        if not search_text.strip():
-            return True
-        return search_text.lower() in (msg.get("content") or "").lower()
-
-    filtered: List[tuple] = []
-    for i, m in enumerate(messages):
-        role_m = m.get("role", "user")
-        pinned = m.get("pinned", False)
-        if role_filter != "all" and role_m != role_filter:
-            continue
-        if show_only_pinned and not pinned:
-            continue
-        if not matches_search(m):
-            continue
-        filtered.append((i, m))
+    page_size = st.session_state.page_size
+    page_offset = st.session_state.history_page * page_size
+    filters_active = bool(search_text.strip()) or role_filter != "all" or show_only_pinned
 
+    # Only the current page is rendered; filters produce index views over the cached session, not copies.
+    if filters_active:
+        view = memory.get_session(st.session_state.session_id).filter(
+            role=None if role_filter == "all" else role_filter,
+            pinned_only=show_only_pinned,
+            query=search_text,
+        )
+        total_visible = len(view)
+        page_end = max(total_visible - page_offset, 0)
+        page = view[max(page_end - page_size, 0):page_end]
+    else:
+        page, _, total_visible = memory.get_window(st.session_state.session_id, page_size, page_offset)
+    filtered: List[tuple] = list(page.items())
+
+    older_hidden = max(total_visible - page_offset - len(filtered), 0)
+    p1, p2, p3 = st.columns([1, 2, 1])
+    with p1:
+        if older_hidden and st.button(f"⬆️ Load older ({older_hidden})", key="page_older"):
+            st.session_state.history_page += 1
+            rerun()
+    with p2:
+        if filtered:
+            st.caption(f"Showing {len(filtered)} of {total_visible} messages")
+    with p3:
+        if st.session_state.history_page > 0 and st.button("⬇️ Newer", key="page_newer"):
+            st.session_state.history_page -= 1
+            rerun()
 
     if sort_order == "timestamp (oldest first)":
-        filtered.sort(key=lambda x: messages[x[0]].get("timestamp", ""))
+        filtered.sort(key=lambda x: x[1].get("timestamp", ""))
 
     for idx, msg in filtered:
         r = msg.get("role", "user")
@@ -277,7 +355,11 @@ with left:
         pinned = msg.get("pinned", False)
         avatar = "👤" if r == "user" else "🤖" if r == "assistant" else "⚙️"  # New: avatars
         bubble_class = "jarvis-bubble jarvis-user" if r == "user" else "jarvis-bubble jarvis-assistant" if r == "assistant" else "jarvis-bubble"
-        display_html = safe_highlight(content, search_text)
+        msg_key = msg.get("id") or f"{st.session_state.session_id}:{idx}"
+        rendered = st.session_state.render_cache.render(
+            msg_key, content, search_text, "dark" if st.session_state.dark_mode else "light"
+        )
+        display_html = rendered.html
 
         st.markdown(
             f"<div style='display:flex;justify-content:space-between;align-items:center'>"
@@ -294,77 +376,72 @@ with left:
             unsafe_allow_html=True
         )
 
-        if "```" in content:
-            parts = content.split("```")
-            for part_i in range(1, len(parts), 2):
-                code_block = parts[part_i].strip()
-                st.code(code_block, language="python")
-                c1, c2 = st.columns([1, 1])
-                with c1:
-                    if st.button("Copy code", key=f"copy_{idx}_{part_i}"):
-                        st.session_state.copied_code = code_block
-                        st.success("Code copied to session clipboard.")
-                with c2:
-                    if st.button("Run code (local)", key=f"run_{idx}_{part_i}"):
-                        if not st.session_state.enable_code_execution:
-                            st.error("Code execution disabled in sidebar.")
-                        else:
-                            out = run_python_code_safely(code_block, timeout=st.session_state.code_timeout)
-                            st.text_area("stdout", out.get("stdout", ""), height=120)
-                            st.text_area("stderr", out.get("stderr", ""), height=60)
-                            if out["rc"] == "0":
-                                st.snow()  
+        for ref in msg.get("attachments") or []:
+            size_kb = max(int(ref.get("size", 0)) // 1024, 1)
+            st.caption(f"📎 {ref.get('name', 'attachment')} ({size_kb} KB)"
+                       + ("" if attachments.exists(ref.get("id", "")) else " — missing"))
+
+        for part_i, code_block in rendered.code_blocks:
+            st.code(code_block, language="python")
+            c1, c2 = st.columns([1, 1])
+            with c1:
+                if st.button("Copy code", key=f"copy_{idx}_{part_i}"):
+                    st.session_state.copied_code = code_block
+                    st.success("Code copied to session clipboard.")
+            with c2:
+                if st.button("Run code (local)", key=f"run_{idx}_{part_i}"):
+                    if not st.session_state.enable_code_execution:
+                        st.error("Code execution disabled in sidebar.")
+                    else:
+                        live_box = st.empty()
+                        live_out: List[str] = []
+
+                        def show_output(stream: str, chunk: str):
+                            live_out.append(chunk)
+                            live_box.code("".join(live_out)[-4000:], language="text")
+
+                        out = run_python_code_safely(code_block, timeout=st.session_state.code_timeout, on_output=show_output)
+                        live_box.empty()
+                        st.text_area("stdout", out.get("stdout", ""), height=120)
+                        st.text_area("stderr", out.get("stderr", ""), height=60)
+                        if out["rc"] == "0":
+                            st.snow()  
 
         a1, a2, a3, a4, a5, a6 = st.columns([1,1,1,1,1,1])
         with a1:
             if st.button("✏️ Edit", key=f"edit_{idx}"):
                 st.session_state.pending_compose_value = content
                 st.session_state.editing_idx = idx
+                st.session_state.editing_id = msg.get("id")
                 rerun()
         with a2:
             if st.button("🗑️ Delete", key=f"del_{idx}"):
-                all_data = memory._load()
-                sess = all_data.get("sessions", {}).get(st.session_state.session_id, [])
-                if 0 <= idx < len(sess):
-                    sess.pop(idx)
-                    all_data["sessions"][st.session_state.session_id] = sess
-                    memory._save(all_data)
+                if mutate_message(st.session_state.session_id, idx, msg.get("id"), lambda sess, i: sess.pop(i)):
                     st.success("Message deleted.")
                     rerun()
         with a3:
             if st.button("📌 Pin" if not pinned else "📍 Unpin", key=f"pin_{idx}"):
-                all_data = memory._load()
-                sess = all_data.get("sessions", {}).get(st.session_state.session_id, [])
-                if 0 <= idx < len(sess):
-                    sess[idx]["pinned"] = not sess[idx].get("pinned", False)
-                    all_data["sessions"][st.session_state.session_id] = sess
-                    memory._save(all_data)
+                def toggle_pin(sess, i):
+                    sess[i]["pinned"] = not sess[i].get("pinned", False)
+                if mutate_message(st.session_state.session_id, idx, msg.get("id"), toggle_pin):
                     rerun()
         with a4:
             if r == "assistant":
                 if st.button("🔄 Regenerate", key=f"regen_{idx}"):
-                    all_data = memory._load()
-                    sess = all_data.get("sessions", {}).get(st.session_state.session_id, [])
-                    if 0 <= idx < len(sess) and sess[idx]["role"] == "assistant":
-                        sess.pop(idx)
-                        all_data["sessions"][st.session_state.session_id] = sess
-                        memory._save(all_data)
+                    def drop_assistant(sess, i):
+                        if sess[i]["role"] == "assistant":
+                            sess.pop(i)
+                    if mutate_message(st.session_state.session_id, idx, msg.get("id"), drop_assistant):
                         rerun()
         with a5:
             if st.button("👍", key=f"up_{idx}"):
-                all_data = memory._load()
-                sess = all_data.get("sessions", {}).get(st.session_state.session_id, [])
-                if 0 <= idx < len(sess):
-                    sess[idx]["reaction"] = "up"
-                    memory._save(all_data)
+                if mutate_message(st.session_state.session_id, idx, msg.get("id"),
+                                  lambda sess, i: sess[i].__setitem__("reaction", "up")):
                     rerun()
         with a6:
             if st.button("👎", key=f"down_{idx}"):
-                all_data = memory._load()
-                sess = all_data.get("sessions", {}).get(st.session_state.session_id, [])
-                if 0 <= idx < len(sess):
-                    sess[idx]["reaction"] = "down"
-                    memory._save(all_data)
+                if mutate_message(st.session_state.session_id, idx, msg.get("id"),
+                                  lambda sess, i: sess[i].__setitem__("reaction", "down")):
                     rerun()
 
         st.markdown("---")
@@ -381,47 +458,64 @@ with left:
         submitted = st.form_submit_button("Send")
         if submitted:
             text = (text or "").strip()
-            file_content = ""
+            refs = []
             if uploaded_file:
-                file_content = uploaded_file.read().decode("utf-8")
-                text += f"\n\nAttached file content:\n{file_content}"
+                try:
+                    refs.append(attachments.put(uploaded_file, uploaded_file.name))
+                except ValueError as e:
+                    st.error(f"Attachment rejected: {e}")
+                    st.stop()
+                if not text:
+                    text = f"Please look at the attached file {uploaded_file.name}."
             if not text:
                 st.warning("Please type a message or upload a file.")
             else:
                 if st.session_state.editing_idx is not None:
-                    all_data = memory._load()
-                    sess = all_data.get("sessions", {}).get(st.session_state.session_id, [])
-                    idx = st.session_state.editing_idx
-                    if 0 <= idx < len(sess):
-                        sess[idx]["content"] = text
-                        sess[idx]["edited_at"] = now_str()
-                        all_data["sessions"][st.session_state.session_id] = sess
-                        memory._save(all_data)
+                    def apply_edit(sess, i):
+                        sess[i]["content"] = text
+                        sess[i]["edited_at"] = now_str()
+                        if refs:
+                            sess[i]["attachments"] = list(sess[i].get("attachments") or []) + refs
+                    if mutate_message(st.session_state.session_id, st.session_state.editing_idx,
+                                      st.session_state.editing_id, apply_edit):
                         st.success("Message edited.")
                     else:
                         st.error("Edit index out of range.")
                     st.session_state.editing_idx = None
+                    st.session_state.editing_id = None
                     st.session_state.pending_compose_value = ""
                     rerun()
                 else:
-                    memory.add_message(st.session_state.session_id, "user", text)
+                    memory.add_message(st.session_state.session_id, "user", text, attachments=refs)
                     st.session_state.pending_compose_value = ""
+                    st.session_state.history_page = 0
                     rerun()
 
 with right:
     st.markdown("### Session info")
-    ctx = memory.get_context(st.session_state.session_id)
+    ctx = memory.get_session(st.session_state.session_id)
     st.write(f"Messages: {len(ctx)}")
     if ctx:
         st.write(f"Last: {ctx[-1].get('timestamp','')}")
+    session_jobs = jobs.jobs_for_session(st.session_state.session_id)[:5]
+    if session_jobs:
+        st.markdown("**Background jobs**")
+        for job in session_jobs:
+            status_icon = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}.get(job["status"], "")
+            detail = job.get("error") if job["status"] == "failed" else ""
+            st.write(f"{status_icon} {job['kind']} — {job['status']} {detail or ''}")
+        if any(job["status"] in ("queued", "running") for job in session_jobs) and st.button("Refresh jobs"):
+            rerun()
     st.markdown("---")
     st.markdown("### Prompt preview")
-    last_msgs = memory.get_context(st.session_state.session_id)
+    last_msgs = memory.get_session(st.session_state.session_id)
     sample_topic = ""
     if last_msgs and last_msgs[-1].get("role") == "user":
         sample_topic = last_msgs[-1].get("content","")
-    pb = PromptBuilder(topic=sample_topic or "<no topic>", tone=tone)
-    pb.add_context_messages([m for m in last_msgs if m.get("role") in ("user","assistant")])
+    pb = PromptBuilder(topic=sample_topic or "<no topic>", tone=tone, layout=settings.prompt_layout)
+    pb.attachment_budget_tokens = settings.attachment_prompt_tokens
+    pb.add_context_messages(last_msgs.filter(roles=("user", "assistant")))
+    pb.add_attachments(attachments, session_attachments(last_msgs))
     try:
         preview_prompt = pb.build_for_definition() if is_definition_question(sample_topic) else pb.build(role)
     except Exception as e:
@@ -431,6 +525,9 @@ with right:
     st.markdown("---")
     st.markdown("### Engine")
     st.write(f"Engine status: {engine_status}")
+    if engine is not None and hasattr(engine, "governor"):
+        with st.expander("Rate limiter"):
+            st.json(engine.governor.snapshot())
     if st.button("Test engine"):
         if engine is None:
             st.error("No engine available.")
@@ -442,37 +539,70 @@ with right:
                 st.error(f"Engine test failed: {e}")
 
 
-msgs = memory.get_context(st.session_state.session_id)
+msgs = memory.get_session(st.session_state.session_id)
 if msgs and msgs[-1].get("role") == "user":
-    recent = msgs[-3:] if len(msgs) >= 3 else msgs
+    recent = msgs.last(3)
     last_roles = [m.get("role") for m in recent]
     if "assistant" not in last_roles or last_roles[-1] != "assistant":
         last_user = msgs[-1].get("content","")
-        if is_command(last_user):
-            res = commands.execute(last_user)
-            memory.add_message(st.session_state.session_id, "assistant", f"🧭 {res}")
+        last_user_id = msgs[-1].get("id")
+        res = commands.dispatch(last_user)
+        if res is not None:
+            memory.add_message(st.session_state.session_id, "assistant", f"🧭 {res}", reply_to=last_user_id)
             rerun()
 
         direct_needed = is_definition_question(last_user)
-        pb = PromptBuilder(topic=last_user, tone=tone)
+        pb = PromptBuilder(topic=last_user, tone=tone, layout=settings.prompt_layout)
         pb.avoid_direct_answer = avoid_direct_default and (not direct_needed)
-        pb.add_context_messages([m for m in msgs if m.get("role") in ("user","assistant")])
+        pb.attachment_budget_tokens = settings.attachment_prompt_tokens
+        pb.add_context_messages(msgs.filter(roles=("user", "assistant")))
+        pb.add_attachments(attachments, session_attachments(msgs))
         role_to_use = "coding_assistant" if direct_needed else role
         final_prompt = pb.build(role_to_use)
 
-        with st.spinner("Jarvis is thinking..."):
-            if engine is None:
-                ai_response = "No LLM engine available. Check configuration."
-            else:
-                assistant = JarvisAssistant(engine=engine, prompt_controller=pb, memory=memory)
-                try:
-                    ai_response = assistant.respond(final_prompt, max_tokens=512, temperature=0.0)
-                except Exception as e:
-                    ai_response = f"Model call failed: {e}"
+        session_id = st.session_state.session_id
+        flight_key = prompt_key(session_id, final_prompt)
 
-            memory.add_message(st.session_state.session_id, "assistant", ai_response)
+        def generate_reply() -> Optional[str]:
+            # The marker stops other processes/tabs; single-flight shares the call in this process.
+            if not memory.begin_generation(session_id, flight_key):
+                return None
+            try:
+                if engine is None:
+                    reply = "No LLM engine available. Check configuration."
+                elif isinstance(engine, OllamaEngine):
+                    # Reuse the session's KV context only if history and prompt frame are unchanged
+                    # and this turn adds nothing beyond the user's text (no attachment excerpts).
+                    try:
+                        reply, _ = engine.generate_in_session(session_id, final_prompt, last_user, msgs,
+                                                              frame=pb.frame_key(role_to_use),
+                                                              reuse=not pb.attachments,
+                                                              max_tokens=512, temperature=0.0)
+                    except Exception as e:
+                        reply = f"Model call failed: {e}"
+                else:
+                    assistant = JarvisAssistant(engine=engine, prompt_controller=pb, memory=memory)
+                    try:
+                        reply = assistant.respond(final_prompt, max_tokens=512, temperature=0.0)
+                    except Exception as e:
+                        reply = f"Model call failed: {e}"
+            except BaseException:
+                memory.end_generation(session_id, flight_key)
+                raise
+            # Storing the reply and clearing the marker is a single write.
+            memory.add_message(session_id, "assistant", reply, reply_to=last_user_id, end_generation=flight_key)
+            return reply
+
+        with st.spinner("Jarvis is thinking..."):
+            ai_response, shared = get_default_flight().do(flight_key, generate_reply)
+            if ai_response is None:
+                st.info("Another window is already answering this message.")
+                # Wait for that generation to finish (or its marker to expire), then show the reply.
+                while memory.generation_in_progress(session_id):
+                    time.sleep(0.5)
+                rerun()
 
-            if VOICE_AVAILABLE and st.session_state.enable_voice_output:
+            if not shared and voice is not None and st.session_state.enable_voice_output:
                 try:
                     voice.speak(ai_response)
                 except Exception:
@@ -9,5 +9,16 @@ class Settings:
     api_key: str = os.environ.get("JARVIS_API_KEY", "")
     gemini_model_name: str = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-flash")
     ollama_url: str = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+    gemini_requests_per_minute: float = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "60"))
+    ollama_keep_alive: str = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+    ollama_api: str = os.environ.get("OLLAMA_API", "native")
+    ollama_num_parallel: int = int(os.environ.get("OLLAMA_NUM_PARALLEL", "2"))
+    ollama_num_ctx: int = int(os.environ.get("OLLAMA_NUM_CTX", "4096"))
+    prompt_layout: str = os.environ.get("JARVIS_PROMPT_LAYOUT", "prefix_stable")
     history_file: str = os.environ.get("JARVIS_HISTORY_FILE", "History.json")
-
+    history_archive_after_days: float = float(os.environ.get("JARVIS_HISTORY_ARCHIVE_AFTER_DAYS", "30"))
+    history_max_hot_sessions: int = int(os.environ.get("JARVIS_HISTORY_MAX_HOT_SESSIONS", "50"))
+    history_max_hot_mb: float = float(os.environ.get("JARVIS_HISTORY_MAX_HOT_MB", "8"))
+    attachments_dir: str = os.environ.get("JARVIS_ATTACHMENTS_DIR", "History.attachments")
+    attachment_max_mb: float = float(os.environ.get("JARVIS_ATTACHMENT_MAX_MB", "5"))
+    attachment_prompt_tokens: int = int(os.environ.get("JARVIS_ATTACHMENT_PROMPT_TOKENS", "1500"))
@@ -14,12 +14,13 @@ class JarvisAssistant:
         self.engine = engine
         self.memory = memory
 
-    def respond(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
+    def respond(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                priority: int = 0) -> str:
         """
         Call engine.generate and handle exceptions cleanly.
         """
         try:
-            response = self.engine.generate(prompt, max_tokens=max_tokens, temperature=temperature)
+            response = self.engine.generate(prompt, max_tokens=max_tokens, temperature=temperature, priority=priority)
             return response or ""
         except Exception as e:
             logger.exception("LLM engine call failed: %s", e)
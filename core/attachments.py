@@ -0,0 +1,269 @@
+import codecs
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+
+
+class AttachmentTooLarge(ValueError):
+    pass
+
+
+class AttachmentNotText(ValueError):
+    pass
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class AttachmentStore:
+    """
+    Content-addressed store for uploaded text files.
+
+    Uploads are streamed into line-aligned chunks; each chunk is written once under
+    its sha256, so identical files (or identical parts of edited files) are stored
+    once. A small manifest per file lists its chunk hashes. Messages keep only the
+    reference returned by put() ({"id", "name", "size"}).
+
+    Chunks are immutable, so their word sets (used to pick prompt excerpts) and the
+    manifests are cached in memory by hash; building a prompt only reads the chunks
+    it actually includes.
+    """
+
+    def __init__(self, root: str = "History.attachments", chunk_size: int = 4096,
+                 max_bytes: int = 5 * 1024 * 1024, read_block: int = 64 * 1024,
+                 index_cache_size: int = 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.read_block = read_block
+        self.index_cache_size = index_cache_size
+        self._chunk_dir = os.path.join(root, "chunks")
+        self._manifest_dir = os.path.join(root, "files")
+        self._index: "OrderedDict[str, Tuple[frozenset, int]]" = OrderedDict()
+        self._manifests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self._chunk_dir, digest[:2], digest)
+
+    def _manifest_path(self, file_id: str) -> str:
+        return os.path.join(self._manifest_dir, file_id + ".json")
+
+    @staticmethod
+    def _write_atomic(path: str, payload: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _split(self, stream: BinaryIO) -> Iterator[bytes]:
+        """
+        Yield chunks of at most chunk_size bytes, cut after a newline where possible and
+        otherwise on a UTF-8 character boundary, so every chunk decodes on its own.
+        """
+        buf = b""
+        while True:
+            block = stream.read(self.read_block)
+            if block:
+                buf += block
+            while len(buf) >= self.chunk_size or (not block and buf):
+                cut = buf.rfind(b"\n", 0, self.chunk_size) + 1 if len(buf) > self.chunk_size else len(buf)
+                if cut <= 0:
+                    cut = self.chunk_size
+                    while cut > 1 and buf[cut] & 0xC0 == 0x80:  # continuation byte
+                        cut -= 1
+                yield buf[:cut]
+                buf = buf[cut:]
+            if not block:
+                return
+
+    def put(self, stream: BinaryIO, name: str) -> Dict[str, Any]:
+        """
+        Store a UTF-8 text stream and return its reference. Raises AttachmentTooLarge
+        past max_bytes and AttachmentNotText for undecodable input; nothing is
+        recorded for a rejected upload, and chunks already written are harmless.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        file_hash = hashlib.sha256()
+        chunks: List[str] = []
+        size = 0
+        new_chunks = 0
+        for piece in self._split(stream):
+            size += len(piece)
+            if size > self.max_bytes:
+                raise AttachmentTooLarge(f"{name} is larger than {self.max_bytes // 1024} KB.")
+            try:
+                decoder.decode(piece)
+            except UnicodeDecodeError as e:
+                raise AttachmentNotText(f"{name} is not UTF-8 text.") from e
+            digest = hashlib.sha256(piece).hexdigest()
+            file_hash.update(digest.encode("ascii"))
+            path = self._chunk_path(digest)
+            if not os.path.exists(path):
+                self._write_atomic(path, piece)
+                new_chunks += 1
+            self._remember(self._index, digest, self._index_entry(piece))
+            chunks.append(digest)
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            raise AttachmentNotText(f"{name} is not UTF-8 text.") from e
+
+        file_id = file_hash.hexdigest()[:32]
+        manifest_path = self._manifest_path(file_id)
+        if not os.path.exists(manifest_path):
+            manifest = {"id": file_id, "size": size, "chunks": chunks}
+            self._write_atomic(manifest_path, json.dumps(manifest).encode("utf-8"))
+        logger.debug("Stored attachment %s (%d bytes, %d/%d new chunks)", name, size, new_chunks, len(chunks))
+        return {"id": file_id, "name": name, "size": size}
+
+    def _remember(self, cache: "OrderedDict", key: str, value: Any):
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.index_cache_size:
+                cache.popitem(last=False)
+
+    @staticmethod
+    def _index_entry(piece: bytes) -> Tuple[frozenset, int]:
+        text = piece.decode("utf-8", errors="replace")
+        return frozenset(w.lower() for w in _WORD_RE.findall(text)), _tokens(text)
+
+    def _manifest(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            cached = self._manifests.get(file_id)
+        if cached is not None:
+            return cached
+        try:
+            with open(self._manifest_path(file_id), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(self._manifests, file_id, manifest)
+        return manifest
+
+    def _read_chunk(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._chunk_path(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _chunk_index(self, digest: str) -> Optional[Tuple[frozenset, int]]:
+        with self._cache_lock:
+            entry = self._index.get(digest)
+            if entry is not None:
+                self._index.move_to_end(digest)
+                return entry
+        piece = self._read_chunk(digest)
+        if piece is None:
+            return None
+        entry = self._index_entry(piece)
+        self._remember(self._index, digest, entry)
+        return entry
+
+    def exists(self, file_id: str) -> bool:
+        return os.path.exists(self._manifest_path(file_id))
+
+    def iter_chunks(self, file_id: str) -> Iterator[str]:
+        """Stream a file's text chunk by chunk. Missing files yield nothing."""
+        manifest = self._manifest(file_id)
+        if manifest is None:
+            return
+        # Decode across chunks so characters split by older chunk boundaries survive.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for digest in manifest["chunks"]:
+            piece = self._read_chunk(digest)
+            if piece is None:
+                logger.warning("Attachment %s is missing chunk %s", file_id, digest)
+                continue
+            yield decoder.decode(piece)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def read_text(self, file_id: str, limit: Optional[int] = None) -> str:
+        out: List[str] = []
+        total = 0
+        for text in self.iter_chunks(file_id):
+            out.append(text)
+            total += len(text)
+            if limit is not None and total >= limit:
+                break
+        joined = "".join(out)
+        return joined[:limit] if limit is not None else joined
+
+    def excerpt(self, refs: Sequence[Dict[str, Any]], query: str = "", budget_tokens: int = 1500) -> List[Tuple[str, str]]:
+        """
+        Pick chunks for a prompt: the chunks sharing the most words with `query`
+        (first chunk of each file as a tie-breaker), within `budget_tokens` overall.
+        Returns [(file name, text)] with each file's chunks in document order.
+        """
+        words = {w.lower() for w in _WORD_RE.findall(query or "")}
+        candidates = []  # (score, file order, chunk order, digest, tokens)
+        seen = set()
+        for f_i, ref in enumerate(refs):
+            file_id = ref.get("id")
+            if not file_id or file_id in seen:
+                continue
+            seen.add(file_id)
+            manifest = self._manifest(file_id)
+            for c_i, digest in enumerate(manifest["chunks"] if manifest else ()):
+                entry = self._chunk_index(digest)
+                if entry is None:
+                    continue
+                chunk_words, cost = entry
+                score = len(words & chunk_words) + (0.5 if c_i == 0 else 0.0)
+                candidates.append((score, f_i, c_i, digest, cost))
+
+        picked = []
+        used = 0
+        for score, f_i, c_i, digest, cost in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+            if used + cost > budget_tokens:
+                continue
+            piece = self._read_chunk(digest)
+            if piece is None:
+                continue
+            picked.append((f_i, c_i, piece.decode("utf-8", errors="replace")))
+            used += cost
+
+        result: List[Tuple[str, str]] = []
+        prev = None
+        for f_i, c_i, text in sorted(picked):
+            if prev is not None and prev[0] == f_i:
+                gap = "" if prev[1] == c_i - 1 else "\n…\n"
+                result[-1] = (result[-1][0], result[-1][1] + gap + text)
+            else:
+                result.append((refs[f_i].get("name", "attachment"), text))
+            prev = (f_i, c_i)
+        return result
+
+
+_default_store: Optional[AttachmentStore] = None
+
+
+def get_default_store(root: str = "History.attachments", max_bytes: Optional[int] = None) -> AttachmentStore:
+    """Process-wide store (Streamlit reruns the script; the store is just a directory, so this is cheap)."""
+    global _default_store
+    if _default_store is None or _default_store.root != root:
+        _default_store = AttachmentStore(root=root)
+    if max_bytes is not None:
+        _default_store.max_bytes = max_bytes
+    return _default_store
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for command detection/dispatch with many registered commands.
+Not used by the main app directly. Run with: python -m core.command_bench
+"""
+import random
+import re
+import string
+import timeit
+
+from core.command_engine import Command, CommandEngine
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+
+
+def build_engine(n_commands: int, seed: int = 7) -> CommandEngine:
+    rng = random.Random(seed)
+    engine = CommandEngine()
+    for i in range(n_commands):
+        verb, noun = _word(rng), _word(rng)
+        engine.register(Command(
+            name=f"cmd_{i}",
+            handler=lambda args, i=i: f"ran {i} {args}",
+            phrases=[f"{verb} {noun}"],
+            patterns=[rf"\b{verb}\s+(?P<target>\w+)"],
+        ))
+    return engine
+
+
+def naive_detect(engine: CommandEngine, text: str) -> bool:
+    """Per-call list building and per-pattern search, as the old is_command did."""
+    txt = text.lower().strip()
+    for cmd in engine.registry.commands():
+        for p in list(cmd.phrases):
+            if p and p in txt:
+                return True
+        for pat in cmd.patterns:
+            if re.search(pat, txt):
+                return True
+    return False
+
+
+if __name__ == "__main__":
+    samples = [
+        "Explain how transformers work in simple terms with a couple of examples please",
+        "search youtube lofi beats",
+        "what is the difference between a list and a tuple in python",
+        "open google",
+    ]
+    for n in (10, 100, 300, 1000):
+        engine = build_engine(n)
+        engine.registry.match("warm up")
+        number = 2000
+        fast = timeit.timeit(lambda: [engine.registry.match(s) for s in samples], number=number)
+        slow = timeit.timeit(lambda: [naive_detect(engine, s) for s in samples], number=max(number // 20, 1))
+        per_fast = fast / (number * len(samples)) * 1e6
+        per_slow = slow / (max(number // 20, 1) * len(samples)) * 1e6
+        print(f"{n:5d} commands: compiled {per_fast:8.2f} us/msg   naive {per_slow:9.2f} us/msg")
@@ -1,65 +1,335 @@
-
 import webbrowser
 import urllib.parse
-from typing import Optional
+from dataclasses import dataclass
+from typing import Optional, Callable, Dict, List, Sequence, Set, Tuple
 import logging
 import re
+import threading
 
 logger = logging.getLogger(__name__)
 
+try:
+    from re import _parser as _sre_parse, _constants as _sre_const
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_const
+
+
+def _required_literals(items) -> Optional[Set[str]]:
+    """
+    Return a set of lowercase strings such that every match of the parsed
+    regex contains at least one of them, or None if no such set is known.
+    """
+    best: Optional[Set[str]] = None
+    run: List[str] = []
+
+    def consider(candidate: Optional[Set[str]]):
+        nonlocal best
+        if candidate and all(candidate):
+            if best is None or min(map(len, candidate)) > min(map(len, best)):
+                best = candidate
+
+    for op, av in items:
+        if op is _sre_const.LITERAL:
+            run.append(chr(av).lower())
+            continue
+        if run:
+            consider({"".join(run)})
+            run = []
+        if op is _sre_const.SUBPATTERN:
+            consider(_required_literals(av[-1]))
+        elif op is _sre_const.BRANCH:
+            union: Set[str] = set()
+            for alt in av[1]:
+                lits = _required_literals(alt)
+                if not lits:
+                    union = set()
+                    break
+                union |= lits
+            consider(union or None)
+        elif op in (_sre_const.MAX_REPEAT, _sre_const.MIN_REPEAT) and av[0] >= 1:
+            consider(_required_literals(av[2]))
+    if run:
+        consider({"".join(run)})
+    return best
+
+
+class _Automaton:
+    """
+    Aho-Corasick automaton over literal keywords; scan() is linear in the text
+    length no matter how many keywords are registered.
+    """
+
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = list(keywords)
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for kid, word in enumerate(self.keywords):
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(kid)
+        fail = [0] * len(goto)
+        frontier = list(goto[0].values())
+        while frontier:
+            nxt_frontier = []
+            for state in frontier:
+                for ch, child in goto[state].items():
+                    f = fail[state]
+                    while f and ch not in goto[f]:
+                        f = fail[f]
+                    fail[child] = goto[f].get(ch, 0) if goto[f].get(ch, 0) != child else 0
+                    out[child] = out[child] + out[fail[child]]
+                    nxt_frontier.append(child)
+            frontier = nxt_frontier
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def scan(self, text: str) -> List[Tuple[int, int]]:
+        """Return (start_index, keyword_id) for every keyword occurrence."""
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        hits: List[Tuple[int, int]] = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for kid in out[state]:
+                    hits.append((i - len(keywords[kid]) + 1, kid))
+        return hits
+
+
+@dataclass
+class Command:
+    """
+    A registered command.
+    - phrases: literal trigger phrases (case-insensitive substring match)
+    - patterns: regexes; named groups become the handler's arguments
+    - fallback: only used when no regular command matched
+    """
+    name: str
+    handler: Callable[[Dict[str, str]], str]
+    phrases: Sequence[str] = ()
+    patterns: Sequence[str] = ()
+    fallback: bool = False
+
+
+@dataclass
+class CommandMatch:
+    command: Command
+    args: Dict[str, str]
+    text: str
+
+
+class CommandRegistry:
+    """
+    Compiles every command's trigger phrases, plus literals every pattern
+    requires, into one Aho-Corasick automaton. A single scan finds the
+    candidates; only patterns whose keywords occur are then verified.
+    The earliest trigger in the text wins; ties go to the earlier-registered command.
+    Fallback commands rank below every regular command.
+    """
+
+    def __init__(self):
+        self._commands: List[Command] = []
+        self._compiled: Optional[tuple] = None
+
+    def register(self, command: Command, overwrite: bool = False) -> Command:
+        if any(c.name == command.name for c in self._commands):
+            if not overwrite:
+                raise KeyError(f"Command '{command.name}' exists. Use overwrite=True to replace.")
+            self._commands = [c for c in self._commands if c.name != command.name]
+        for p in command.patterns:
+            re.compile(p)
+        self._commands.append(command)
+        self._compiled = None
+        return command
+
+    def unregister(self, name: str):
+        self._commands = [c for c in self._commands if c.name != name]
+        self._compiled = None
+
+    def commands(self) -> List[Command]:
+        return list(self._commands)
+
+    def _compile(self) -> tuple:
+        keyword_ids: Dict[str, int] = {}
+        owners: List[List[Tuple[int, Optional["re.Pattern"]]]] = []
+        unanchored: List[Tuple[int, "re.Pattern"]] = []
+
+        def own(word: str, entry: Tuple[int, Optional["re.Pattern"]]):
+            kid = keyword_ids.setdefault(word, len(keyword_ids))
+            if kid == len(owners):
+                owners.append([])
+            owners[kid].append(entry)
+
+        for order, cmd in enumerate(self._commands):
+            for phrase in {p.lower() for p in cmd.phrases if p}:
+                own(phrase, (order, None))
+            for source in cmd.patterns:
+                pat = re.compile(source, re.IGNORECASE)
+                literals = _required_literals(_sre_parse.parse(source, re.IGNORECASE))
+                if literals:
+                    for word in literals:
+                        own(word, (order, pat))
+                else:
+                    unanchored.append((order, pat))
+        compiled = (_Automaton(list(keyword_ids)), owners, unanchored)
+        self._compiled = compiled
+        return compiled
+
+    def match(self, text: str) -> Optional[CommandMatch]:
+        if not text:
+            return None
+        txt = text.lower().strip()
+        if not txt:
+            return None
+        automaton, owners, unanchored = self._compiled or self._compile()
+        commands = self._commands
+        best: Optional[Tuple[bool, int, int]] = None
+        best_match = None
+        to_verify: Dict[Tuple[int, int], Tuple[int, "re.Pattern"]] = {}
+        for start, kid in automaton.scan(txt):
+            for order, pat in owners[kid]:
+                if pat is None:
+                    rank = (commands[order].fallback, start, order)
+                    if best is None or rank < best:
+                        best, best_match = rank, None
+                else:
+                    to_verify[(order, id(pat))] = (order, pat)
+        for order, pat in list(to_verify.values()) + unanchored:
+            m = pat.search(txt)
+            if m:
+                rank = (commands[order].fallback, m.start(), order)
+                if best is None or rank < best:
+                    best, best_match = rank, m
+        if best is None:
+            return None
+        args = {k: (v or "").strip() for k, v in best_match.groupdict().items()} if best_match else {}
+        return CommandMatch(command=commands[best[2]], args=args, text=txt)
+
+
+DEFAULT_COMMAND_PHRASES = [
+    "open google",
+    "open youtube",
+    "search google",
+    "search youtube",
+    "google ",
+    "youtube ",
+    "search ",
+]
+
+UNKNOWN_COMMAND_MESSAGE = "Unknown command. Try 'open google', 'search google cats', or 'search youtube cats'."
+
+
 class CommandEngine:
     """
     Handles system & browser level commands. Returns user-friendly messages on actions.
+    Commands live in a CommandRegistry; call register() to plug in new ones.
     """
 
-    def __init__(self):
+    def __init__(self, registry: Optional[CommandRegistry] = None):
         self._open_map = {
             "google": "https://www.google.com",
             "youtube": "https://www.youtube.com",
         }
+        self.registry = registry or CommandRegistry()
+        if registry is None:
+            self._register_defaults()
 
-    def execute(self, command: str) -> str:
-        if not command or not command.strip():
-            return "No command provided."
+    def _register_defaults(self):
+        self.registry.register(Command(
+            name="open_site",
+            handler=self._open_site,
+            patterns=[r"\b(?:open|go to|visit)\b\s+(?P<site>\w+)"],
+        ))
+        self.registry.register(Command(
+            name="search_google",
+            handler=lambda args: self._search("Google", "https://www.google.com/search?q=", args),
+            patterns=[r"(?:search google|^google )\s*(?P<query>.*)"],
+        ))
+        self.registry.register(Command(
+            name="search_youtube",
+            handler=lambda args: self._search("YouTube", "https://www.youtube.com/results?search_query=", args),
+            patterns=[r"(?:search youtube|^youtube )\s*(?P<query>.*)"],
+        ))
+        self.registry.register(Command(
+            name="unknown",
+            handler=lambda args: UNKNOWN_COMMAND_MESSAGE,
+            phrases=DEFAULT_COMMAND_PHRASES,
+            patterns=[r"\b(?:open|visit|search|find|google|youtube)\b"],
+            fallback=True,
+        ))
 
-        cmd = command.lower().strip()
-
-
-        open_match = re.search(r"\b(open|go to|visit)\b\s+(\w+)", cmd)
-        if open_match:
-            site = open_match.group(2)
-            url = self._open_map.get(site)
-            if url:
-                try:
-                    webbrowser.open(url)
-                    return f"Opening {site.capitalize()}."
-                except Exception as e:
-                    logger.exception("Failed to open browser URL: %s", e)
-                    return f"Failed to open {site}: {e}"
-            return f"I don't know how to open '{site}'. Try 'open google' or 'open youtube'."
-
-        if "search google" in cmd or cmd.startswith("google "):
-            q = re.sub(r"(search google|google)\s*", "", cmd).strip()
-            if not q:
-                return "What do you want to search for on Google?"
-            url = f"https://www.google.com/search?q={urllib.parse.quote(q)}"
-            try:
-                webbrowser.open(url)
-                return f"Searching Google for '{q}'."
-            except Exception as e:
-                logger.exception("Failed to open search URL: %s", e)
-                return f"Failed to perform search: {e}"
-            
-        if "search youtube" in cmd or cmd.startswith("youtube "):
-            q = re.sub(r"(search youtube|youtube)\s*", "", cmd).strip()
-            if not q:
-                return "What do you want to search for on YouTube?"
-            url = f"https://www.youtube.com/results?search_query={urllib.parse.quote(q)}"
+    def register(self, command: Command, overwrite: bool = False) -> Command:
+        return self.registry.register(command, overwrite=overwrite)
+
+    def _open_site(self, args: Dict[str, str]) -> str:
+        site = args.get("site", "")
+        url = self._open_map.get(site)
+        if url:
             try:
                 webbrowser.open(url)
-                return f"Searching YouTube for '{q}'."
+                return f"Opening {site.capitalize()}."
             except Exception as e:
-                logger.exception("Failed to open search URL: %s", e)
-                return f"Failed to perform search: {e}"
+                logger.exception("Failed to open browser URL: %s", e)
+                return f"Failed to open {site}: {e}"
+        return f"I don't know how to open '{site}'. Try 'open google' or 'open youtube'."
 
-        return "Unknown command. Try 'open google', 'search google cats', or 'search youtube cats'."
+    def _search(self, label: str, base_url: str, args: Dict[str, str]) -> str:
+        q = args.get("query", "")
+        if not q:
+            return f"What do you want to search for on {label}?"
+        url = f"{base_url}{urllib.parse.quote(q)}"
+        try:
+            webbrowser.open(url)
+            return f"Searching {label} for '{q}'."
+        except Exception as e:
+            logger.exception("Failed to open search URL: %s", e)
+            return f"Failed to perform search: {e}"
+
+    def dispatch(self, text: str) -> Optional[str]:
+        """
+        Detect and run a command in one pass. Returns None if text is not a command.
+        """
+        match = self.registry.match(text)
+        if match is None:
+            return None
+        return match.command.handler(match.args)
+
+    def execute(self, command: str) -> str:
+        if not command or not command.strip():
+            return "No command provided."
+        result = self.dispatch(command)
+        return UNKNOWN_COMMAND_MESSAGE if result is None else result
+
+
+_default_engine: Optional[CommandEngine] = None
+_default_lock = threading.Lock()
+
+
+def get_default_engine() -> CommandEngine:
+    """
+    Process-wide CommandEngine shared by all Streamlit sessions; its registry is
+    compiled once and recompiled only when commands are (un)registered.
+    """
+    global _default_engine
+    with _default_lock:
+        if _default_engine is None:
+            _default_engine = CommandEngine()
+        return _default_engine
+
+
+def default_registry() -> CommandRegistry:
+    """
+    Registry holding the built-in commands, compiled once per process.
+    """
+    return get_default_engine().registry
@@ -9,9 +9,11 @@ class BaseLLMEngine(ABC):
     """
 
     @abstractmethod
-    def generate(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
+    def generate(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 priority: int = 0) -> str:
         """
         Generate a text response for the given prompt.
         Should return a plain string (not an object).
+        priority: lower is served first when the engine is saturated (see core.rate_limit).
         """
         raise NotImplementedError
@@ -1,5 +1,6 @@
 from typing import Optional
 from .engine_base import BaseLLMEngine
+from .rate_limit import INTERACTIVE, get_governor
 import logging
 
 try:
@@ -17,9 +18,17 @@ class GeminiEngine(BaseLLMEngine):
     If the package isn't available, raises a helpful error when generate() is called.
     """
 
-    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash"):
+    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash",
+                 requests_per_minute: float = 60.0, max_concurrency: int = 8, queue_timeout: float = 60.0):
         self.api_key = api_key
         self.model_name = model_name
+        self.queue_timeout = queue_timeout
+        self.governor = get_governor(
+            f"gemini:{model_name}",
+            rate=requests_per_minute / 60.0,
+            burst=max(1, int(requests_per_minute // 10)),
+            max_concurrency=max_concurrency,
+        )
         self._client_configured = False
         self._model = None
         if HAS_GENAI and api_key:
@@ -31,7 +40,8 @@ class GeminiEngine(BaseLLMEngine):
                 logger.exception("Failed to configure Gemini client: %s", e)
                 self._client_configured = False
 
-    def generate(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
+    def generate(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 priority: int = INTERACTIVE) -> str:
         if not HAS_GENAI:
             raise RuntimeError("google.generativeai library not installed. Install it or use a different engine.")
         if not self._client_configured or self._model is None:
@@ -44,7 +54,9 @@ class GeminiEngine(BaseLLMEngine):
             kwargs["temperature"] = temperature
 
         try:
-            response = self._model.generate_content(prompt, **kwargs)
+            with self.governor.slot(priority, timeout=self.queue_timeout) as usage:
+                response = self._model.generate_content(prompt, **kwargs)
+                usage.output_tokens = getattr(getattr(response, "usage_metadata", None), "candidates_token_count", None)
             if hasattr(response, "text"):
                 return response.text or ""
             elif isinstance(response, dict) and response.get("content"):
@@ -0,0 +1,221 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+_ACTIVE = (QUEUED, RUNNING)
+
+
+class JobScheduler:
+    """
+    Small in-process job scheduler for slow work (summaries, compaction, exports, reindexing).
+    Jobs live in a persistent table inside the history store (data["jobs"]), so they
+    survive restarts and are visible to every worker process; claiming a job is an
+    atomic MemoryManager transaction, so two processes never run the same job.
+    Each claim gets its own token and the lease is renewed while the handler runs;
+    only the current claim may finish a job.
+    Handlers are registered per job kind: handler(job) -> result (JSON-serialisable).
+    """
+
+    def __init__(self, memory, workers: int = 2, poll_interval: float = 5.0,
+                 lease_seconds: float = 300.0, retention_seconds: float = 24 * 3600):
+        self.memory = memory
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any], overwrite: bool = False):
+        if kind in self._handlers and not overwrite:
+            raise KeyError(f"Job kind '{kind}' exists. Use overwrite=True to replace.")
+        self._handlers[kind] = handler
+
+    def start(self) -> "JobScheduler":
+        if self._threads:
+            return self
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"jarvis-jobs-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    # ---------- producer side ----------
+
+    def enqueue(self, kind: str, session_id: Optional[str] = None, payload: Optional[Dict[str, Any]] = None,
+                dedupe: bool = True, max_attempts: int = 3) -> str:
+        """
+        Queue a job and return its id. With dedupe, an already queued/running job of the
+        same kind for the same session is reused instead of adding another.
+        """
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "session_id": session_id,
+            "payload": payload or {},
+            "status": QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_after": now,
+            "created": now,
+            "updated": now,
+            "result": None,
+            "error": None,
+        }
+
+        def op(data: Dict[str, Any]) -> str:
+            jobs = data.setdefault("jobs", {})
+            if dedupe:
+                for existing in jobs.values():
+                    if (existing.get("kind") == kind and existing.get("session_id") == session_id
+                            and existing.get("status") in _ACTIVE):
+                        return existing["id"]
+            jobs[job["id"]] = job
+            return job["id"]
+
+        job_id = self.memory.update(op)
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.memory.read().get("jobs", {}).get(job_id)
+
+    def jobs_for_session(self, session_id: str) -> List[Dict[str, Any]]:
+        jobs = [j for j in self.memory.read().get("jobs", {}).values() if j.get("session_id") == session_id]
+        return sorted(jobs, key=lambda j: j.get("created", 0), reverse=True)
+
+    # ---------- worker side ----------
+
+    def _runnable(self, jobs: Dict[str, Dict[str, Any]], now: float) -> List[Dict[str, Any]]:
+        kinds = set(self._handlers)
+        return [
+            job for job in jobs.values()
+            if job.get("kind") in kinds and (
+                (job.get("status") == QUEUED and job.get("run_after", 0) <= now)
+                or (job.get("status") == RUNNING and job.get("lease_until", 0) < now)  # crashed worker
+            )
+        ]
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        # Cheap read-only check first so idle workers never rewrite the store.
+        if not self._runnable(self.memory.read().get("jobs", {}), time.time()):
+            return None
+
+        def op(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            jobs = data.get("jobs")
+            if not jobs:
+                return None
+            now = time.time()
+            for job_id in [j for j, job in jobs.items()
+                           if job.get("status") in (DONE, FAILED)
+                           and now - job.get("updated", 0) > self.retention_seconds]:
+                del jobs[job_id]
+            runnable = []
+            for job in self._runnable(jobs, now):
+                if job.get("status") == RUNNING and job.get("attempts", 0) >= job.get("max_attempts", 1):
+                    # Lease expired on the last attempt: the worker died (maybe because of the job).
+                    job.update(status=FAILED, error=job.get("error") or "Worker stopped before finishing (lease expired).",
+                               updated=now, claim=None)
+                else:
+                    runnable.append(job)
+            if not runnable:
+                return None
+            job = min(runnable, key=lambda j: j.get("run_after", 0))
+            job.update(status=RUNNING, owner=self.owner, claim=uuid.uuid4().hex,
+                       lease_until=now + self.lease_seconds, attempts=job.get("attempts", 0) + 1, updated=now)
+            return dict(job)
+
+        return self.memory.update(op)
+
+    def _finish(self, job: Dict[str, Any], result: Any = None, error: Optional[str] = None):
+        def op(data: Dict[str, Any]):
+            stored = data.get("jobs", {}).get(job["id"])
+            if stored is None or stored.get("claim") != job.get("claim"):
+                return
+            now = time.time()
+            if error is None:
+                stored.update(status=DONE, result=result, error=None, updated=now, claim=None)
+            elif stored.get("attempts", 0) < stored.get("max_attempts", 1):
+                backoff = min(2 ** stored.get("attempts", 0), 60)
+                stored.update(status=QUEUED, error=error, run_after=now + backoff, updated=now, claim=None)
+            else:
+                stored.update(status=FAILED, error=error, updated=now, claim=None)
+        self.memory.update(op)
+
+    def _renew_lease(self, job: Dict[str, Any]) -> bool:
+        def op(data: Dict[str, Any]) -> bool:
+            stored = data.get("jobs", {}).get(job["id"])
+            if stored is None or stored.get("claim") != job.get("claim"):
+                return False
+            stored["lease_until"] = time.time() + self.lease_seconds
+            return True
+        return self.memory.update(op)
+
+    def _keep_alive(self, job: Dict[str, Any], done: threading.Event):
+        """Renew the lease every third of its length until the handler returns."""
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                if not self._renew_lease(job):
+                    logger.warning("Lost the lease on job %s (%s)", job["id"], job["kind"])
+                    return
+            except Exception:
+                logger.exception("Failed to renew lease on job %s", job["id"])
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("Failed to claim job")
+                job = None
+            if job is None:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+            handler = self._handlers.get(job["kind"])
+            done = threading.Event()
+            threading.Thread(target=self._keep_alive, args=(job, done), daemon=True).start()
+            try:
+                result = handler(job)
+            except Exception as e:
+                done.set()
+                logger.exception("Job %s (%s) failed", job["id"], job["kind"])
+                self._finish(job, error=str(e) or e.__class__.__name__)
+            else:
+                done.set()
+                self._finish(job, result=result)
+
+
+_default_scheduler: Optional[JobScheduler] = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler(memory) -> JobScheduler:
+    """
+    Process-wide scheduler, started on first use.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = JobScheduler(memory).start()
+        return _default_scheduler
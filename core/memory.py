@@ -1,24 +1,92 @@
 # core/memory.py
+import gzip
+import hashlib
 import json
+import lzma
 import os
+import re
 import tempfile
+import time
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import threading
+import uuid
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:  # Windows: only in-process locking is available
+    HAS_FCNTL = False
+
+from .message import Session, SessionView, parse_timestamp_us
 
 logger = logging.getLogger(__name__)
 
+_ARCHIVE_OPENERS = {".json.gz": gzip.open, ".json.xz": lzma.open}
+_SAFE_SESSION_ID = re.compile(r"[\w-]{1,100}")
+
+
+class _PendingOp:
+    __slots__ = ("fn", "after", "done", "result", "error")
+
+    def __init__(self, fn: Callable[[Dict[str, Any]], Any], after: Optional[Callable[[], None]] = None):
+        self.fn = fn
+        self.after = after
+        self.done = False
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+def _parse_timestamp(ts: Any) -> float:
+    us = parse_timestamp_us(ts)
+    return us / 1e6 if us is not None else 0.0
+
+
 class MemoryManager:
     """
-    Thread-safe file-backed session memory manager.
+    Thread- and process-safe file-backed session memory manager.
     Stores messages per session as a list of dicts.
+
+    Every mutation is a read-modify-write transaction under an OS-level file
+    lock (fcntl), so concurrent workers do not lose updates. Mutations that
+    arrive while a commit is in flight, or within `commit_window` seconds of
+    the first one, are applied together and written once (group commit).
+
+    Sessions are tiered: the hot file only holds recently active sessions.
+    Sessions idle longer than `archive_after_seconds`, or the least recently
+    active ones once `max_hot_sessions` / `max_hot_bytes` is exceeded, are moved
+    to compressed per-session archives and rehydrated when opened again.
     """
 
-    def __init__(self, file_path: str = "History.json", max_messages: int = 200):
+    def __init__(self, file_path: str = "History.json", max_messages: int = 200,
+                 archive_after_seconds: Optional[float] = 30 * 24 * 3600,
+                 max_hot_sessions: Optional[int] = 50,
+                 max_hot_bytes: Optional[int] = 8 * 1024 * 1024,
+                 archive_format: str = "gzip",
+                 commit_window: float = 0.003):
+        if archive_format not in ("gzip", "lzma"):
+            raise ValueError("archive_format must be 'gzip' or 'lzma'.")
         self.file_path = file_path
         self.max_messages = max_messages
-        self._lock = threading.Lock()
+        self.archive_after_seconds = archive_after_seconds
+        self.max_hot_sessions = max_hot_sessions
+        self.max_hot_bytes = max_hot_bytes
+        self.archive_ext = ".json.gz" if archive_format == "gzip" else ".json.xz"
+        base = os.path.basename(self.file_path)
+        self.archive_dir = os.path.join(os.path.dirname(self.file_path), os.path.splitext(base)[0] + ".archive")
+        self.commit_window = commit_window
+        self.lock_path = self.file_path + ".lock"
+        self._lock = threading.RLock()
+        self._batch: List[_PendingOp] = []
+        self._batch_cond = threading.Condition()
+        self._committing = False
+        self.commits = 0
+        self._session_cache: "OrderedDict[str, Tuple[tuple, Session]]" = OrderedDict()
+        self._read_cache: Optional[Tuple[tuple, Dict[str, Any]]] = None
+        self.session_cache_size = 32
         self._ensure_file()
 
     def _ensure_file(self):
@@ -54,30 +122,415 @@ class MemoryManager:
                     os.remove(tmp)
                 raise
 
-    def add_message(self, session_id: str, role: str, content: str, model: str = "gemini"):
+    # ---------- transactions / group commit ----------
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock:
+            if not HAS_FCNTL:
+                yield
+                return
+            with open(self.lock_path, "a+") as fh:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def _commit(self, batch: List[_PendingOp]):
+        with self._file_lock():
+            # A failing op may have half-mutated `data`: drop it, reload and replay the
+            # others, so nothing from a failed op is ever saved.
+            pending = list(batch)
+            while True:
+                data = self._load()
+                failed = None
+                for op in pending:
+                    try:
+                        op.result = op.fn(data)
+                    except Exception as e:
+                        logger.exception("Memory mutation failed; rolling it back.")
+                        op.error = e
+                        failed = op
+                        break
+                if failed is None:
+                    break
+                pending = [op for op in pending if op is not failed]
+            try:
+                self._save(data)
+                self.commits += 1
+            except Exception as e:
+                for op in batch:
+                    op.error = op.error or e
+        for op in batch:
+            if op.after is not None and op.error is None:
+                try:
+                    op.after()
+                except Exception:
+                    logger.exception("Post-commit action failed.")
+
+    def _submit(self, fn: Callable[[Dict[str, Any]], Any], after: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Queue a mutation fn(data) and block until it is committed; returns fn's result.
+        The first caller becomes the committer for everything queued meanwhile.
+        """
+        op = _PendingOp(fn, after)
+        with self._batch_cond:
+            self._batch.append(op)
+            if self._committing:
+                while not op.done:
+                    self._batch_cond.wait()
+                if op.error is not None:
+                    raise op.error
+                return op.result
+            self._committing = True
+        if self.commit_window > 0:
+            time.sleep(self.commit_window)
+        try:
+            while True:
+                with self._batch_cond:
+                    batch, self._batch = self._batch, []
+                    if not batch:
+                        break
+                try:
+                    self._commit(batch)
+                finally:
+                    with self._batch_cond:
+                        for pending in batch:
+                            pending.done = True
+                        self._batch_cond.notify_all()
+        finally:
+            with self._batch_cond:
+                self._committing = False
+                self._batch_cond.notify_all()
+        if op.error is not None:
+            raise op.error
+        return op.result
+
+    def update(self, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        """
+        Run fn(data) as an atomic read-modify-write transaction on the whole store.
+        """
+        return self._submit(fn)
+
+    def update_session(self, session_id: str, fn: Callable[[List[Dict[str, Any]]], Any]) -> Any:
+        """
+        Run fn(messages) atomically on one session's message list (mutate it in place).
+        """
+        def op(data: Dict[str, Any]) -> Any:
+            msgs = data.setdefault("sessions", {}).get(session_id)
+            if msgs is None:
+                return fn([])
+            return fn(msgs)
+        return self._submit(op)
+
+    # ---------- archive tier ----------
+
+    def _archive_path(self, session_id: str, ext: Optional[str] = None) -> str:
+        name = session_id if _SAFE_SESSION_ID.fullmatch(session_id) else hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.archive_dir, name + (ext or self.archive_ext))
+
+    def _write_archive(self, session_id: str, messages: List[Dict[str, Any]], last_active: float):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._archive_path(session_id)
+        fd, tmp = tempfile.mkstemp(dir=self.archive_dir, prefix=".tmp_archive_")
+        os.close(fd)
+        try:
+            with _ARCHIVE_OPENERS[self.archive_ext](tmp, "wt", encoding="utf-8") as f:
+                json.dump({"session_id": session_id, "last_active": last_active, "messages": messages}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception:
+            logger.exception("Failed to write session archive for %s.", session_id)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _read_archive(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        for ext, opener in _ARCHIVE_OPENERS.items():
+            path = self._archive_path(session_id, ext)
+            if os.path.exists(path):
+                try:
+                    with opener(path, "rt", encoding="utf-8") as f:
+                        return json.load(f).get("messages", [])
+                except (OSError, EOFError, json.JSONDecodeError, lzma.LZMAError):
+                    logger.exception("Failed to read session archive %s.", path)
+                    return None
+        return None
+
+    def _remove_archive(self, session_id: str):
+        for ext in _ARCHIVE_OPENERS:
+            path = self._archive_path(session_id, ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _last_active(self, data: Dict[str, Any], session_id: str) -> float:
+        ts = data.get("last_active", {}).get(session_id)
+        if ts:
+            return float(ts)
+        msgs = data.get("sessions", {}).get(session_id) or []
+        return _parse_timestamp(msgs[-1].get("timestamp")) if msgs else 0.0
+
+    @staticmethod
+    def _estimate_bytes(messages: List[Dict[str, Any]]) -> int:
+        return sum(len(str(m.get("content", ""))) + 160 for m in messages)
+
+    def _tier(self, data: Dict[str, Any], keep: Optional[str] = None):
+        """
+        Move idle / over-budget sessions out of `data` into archives (oldest first).
+        """
+        sessions = data.get("sessions", {})
+        if not sessions:
+            return
+        now = time.time()
+        order = sorted(sessions, key=lambda sid: self._last_active(data, sid))
+        evict = []
+        if self.archive_after_seconds is not None:
+            evict = [sid for sid in order if sid != keep and now - self._last_active(data, sid) > self.archive_after_seconds]
+        hot = [sid for sid in order if sid not in evict]
+        hot_bytes = sum(self._estimate_bytes(sessions[sid]) for sid in hot) if self.max_hot_bytes is not None else 0
+        for sid in list(hot):
+            over_count = self.max_hot_sessions is not None and len(hot) > self.max_hot_sessions
+            over_bytes = self.max_hot_bytes is not None and hot_bytes > self.max_hot_bytes
+            if not (over_count or over_bytes):
+                break
+            if sid == keep:
+                continue
+            hot.remove(sid)
+            evict.append(sid)
+            if self.max_hot_bytes is not None:
+                hot_bytes -= self._estimate_bytes(sessions[sid])
+        if not evict:
+            return
+        archived = data.setdefault("archived", {})
+        last_active = data.setdefault("last_active", {})
+        for sid in evict:
+            msgs = sessions[sid]
+            active = self._last_active(data, sid)
+            self._write_archive(sid, msgs, active)
+            archived[sid] = {"last_active": active, "messages": len(msgs)}
+            del sessions[sid]
+            last_active.pop(sid, None)
+
+    def _rehydrate(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        def op(data: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+            if session_id in data.get("sessions", {}):
+                return data["sessions"][session_id]
+            if session_id not in data.get("archived", {}):
+                return None
+            msgs = self._read_archive(session_id)
+            if msgs is None:
+                return None
+            data.setdefault("sessions", {})[session_id] = msgs
+            data["archived"].pop(session_id, None)
+            data.setdefault("last_active", {})[session_id] = time.time()
+            self._tier(data, keep=session_id)
+            return msgs
+
+        return self._submit(op, after=lambda: self._drop_stale_archive(session_id))
+
+    def _drop_stale_archive(self, session_id: str):
+        """Delete a session's archive file once the session is hot again."""
+        with self._file_lock():
+            if session_id not in self._load().get("archived", {}):
+                self._remove_archive(session_id)
+
+    def archive_idle_sessions(self):
+        """Apply the tiering policy now (it otherwise runs on every new message)."""
+        self._submit(self._tier)
+
+    def read(self) -> Dict[str, Any]:
+        """
+        The parsed store, cached per process until the history file changes (same
+        signature check as get_session). Shared between callers: treat it as read-only.
+        """
+        sig = self._file_signature()  # before the read, see get_session
+        with self._lock:
+            if self._read_cache is not None and self._read_cache[0] == sig:
+                return self._read_cache[1]
         data = self._load()
-        sessions = data.setdefault("sessions", {})
-        msgs = sessions.setdefault(session_id, [])
-        msgs.append({
+        with self._lock:
+            self._read_cache = (sig, data)
+        return data
+
+    def list_sessions(self) -> List[Tuple[str, float, bool]]:
+        """
+        All sessions, hot and archived, as (session_id, last_active_epoch, archived), newest first.
+        """
+        data = self.read()
+        out = [(sid, self._last_active(data, sid), False) for sid in data.get("sessions", {})]
+        out += [(sid, float(meta.get("last_active", 0.0)), True)
+                for sid, meta in data.get("archived", {}).items() if sid not in data.get("sessions", {})]
+        out.sort(key=lambda x: x[1], reverse=True)
+        return out
+
+    def add_message(self, session_id: str, role: str, content: str, model: str = "gemini",
+                    reply_to: Optional[str] = None, attachments: Optional[List[Dict[str, Any]]] = None,
+                    end_generation: Optional[str] = None) -> bool:
+        """
+        Append a message. With reply_to (the id of the message being answered) the
+        write is skipped if that message already has a reply, so racing generators
+        cannot store duplicate answers. Returns False if skipped.
+        attachments holds AttachmentStore references only, never file contents.
+        end_generation clears that generation marker in the same write (even if skipped).
+        """
+        message = {
+            "id": uuid.uuid4().hex[:12],
             "role": role,
             "content": content,
             "model": model,
             "timestamp": datetime.utcnow().isoformat() + "Z"
-        })
-        sessions[session_id] = msgs[-self.max_messages:]
-        data["sessions"] = sessions
-        self._save(data)
+        }
+        if reply_to:
+            message["reply_to"] = reply_to
+        if attachments:
+            message["attachments"] = list(attachments)
+
+        rehydrated = []
+
+        def op(data: Dict[str, Any]) -> bool:
+            if end_generation is not None:
+                self._clear_marker(data, session_id, end_generation)
+            sessions = data.setdefault("sessions", {})
+            if session_id not in sessions and session_id in data.get("archived", {}):
+                archived = self._read_archive(session_id)
+                if archived is not None:
+                    sessions[session_id] = archived
+                    data["archived"].pop(session_id, None)
+                    rehydrated.append(True)
+            msgs = sessions.setdefault(session_id, [])
+            if reply_to and any(m.get("reply_to") == reply_to for m in msgs):
+                return False
+            msgs.append(message)
+            sessions[session_id] = msgs[-self.max_messages:]
+            data.setdefault("last_active", {})[session_id] = time.time()
+            self._tier(data, keep=session_id)
+            return True
+
+        def after():
+            if rehydrated:
+                self._drop_stale_archive(session_id)
+
+        return self._submit(op, after=after)
+
+    def begin_generation(self, session_id: str, key: str, ttl: float = 120.0) -> bool:
+        """
+        Mark a generation in progress for a session (visible to every process).
+        Returns False if another, non-expired generation already holds the marker.
+        """
+        def op(data: Dict[str, Any]) -> bool:
+            markers = data.setdefault("generating", {})
+            current = markers.get(session_id)
+            now = time.time()
+            if current and now - float(current.get("since", 0)) < ttl:
+                return False
+            markers[session_id] = {"key": key, "since": now}
+            return True
+        return self._submit(op)
+
+    @staticmethod
+    def _clear_marker(data: Dict[str, Any], session_id: str, key: str):
+        markers = data.get("generating", {})
+        if markers.get(session_id, {}).get("key") == key:
+            del markers[session_id]
+        if not markers:
+            data.pop("generating", None)
+
+    def end_generation(self, session_id: str, key: str):
+        """Clear a marker without storing a reply (prefer add_message(end_generation=...))."""
+        self._submit(lambda data: self._clear_marker(data, session_id, key))
+
+    def generation_in_progress(self, session_id: str, ttl: float = 120.0) -> bool:
+        marker = self.read().get("generating", {}).get(session_id)
+        return bool(marker) and time.time() - float(marker.get("since", 0)) < ttl
 
     def get_context(self, session_id: str) -> List[Dict[str, Any]]:
         data = self._load()
-        return data.get("sessions", {}).get(session_id, [])
+        msgs = data.get("sessions", {}).get(session_id)
+        if msgs is None and session_id in data.get("archived", {}):
+            msgs = self._rehydrate(session_id)
+        return msgs or []
+
+    def _file_signature(self) -> tuple:
+        try:
+            st = os.stat(self.file_path)
+        except FileNotFoundError:
+            return ()
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get_session(self, session_id: str) -> Session:
+        """
+        Columnar, read-only snapshot of a session (see core.message).
+        Snapshots are cached per process and reused until the history file changes.
+        """
+        # Signature first, then read: if the file is replaced in between, the
+        # cached entry carries the older signature and is simply re-read next time.
+        sig = self._file_signature()
+        with self._lock:
+            cached = self._session_cache.get(session_id)
+            if cached is not None and cached[0] == sig:
+                self._session_cache.move_to_end(session_id)
+                return cached[1]
+        data = self.read()
+        msgs = data.get("sessions", {}).get(session_id)
+        if msgs is None and session_id in data.get("archived", {}):
+            # Rehydration rewrites the file; leave caching to the next (hot) read.
+            return Session.from_dicts(session_id, self._rehydrate(session_id) or [])
+        session = Session.from_dicts(session_id, msgs or [])
+        with self._lock:
+            self._session_cache[session_id] = (sig, session)
+            self._session_cache.move_to_end(session_id)
+            while len(self._session_cache) > self.session_cache_size:
+                self._session_cache.popitem(last=False)
+        return session
+
+    def get_window(self, session_id: str, limit: int, offset: int = 0) -> Tuple[SessionView, int, int]:
+        """
+        Return a page of a session without handing the whole history to the caller.
+        `offset` counts messages back from the newest one. Returns (messages, start_index, total).
+        """
+        session = self.get_session(session_id)
+        total = len(session)
+        end = max(total - max(offset, 0), 0)
+        start = max(end - max(limit, 0), 0)
+        return session[start:end], start, total
 
     def clear_session(self, session_id: str):
-        data = self._load()
-        if session_id in data.get("sessions", {}):
-            del data["sessions"][session_id]
-            self._save(data)
+        def op(data: Dict[str, Any]):
+            data.get("sessions", {}).pop(session_id, None)
+            data.get("last_active", {}).pop(session_id, None)
+            data.get("archived", {}).pop(session_id, None)
+
+        self._submit(op, after=lambda: self._remove_archive(session_id))
 
     def clear_all(self):
-        self._save({"sessions": {}})
+        def op(data: Dict[str, Any]):
+            data.clear()
+            data["sessions"] = {}
+
+        def after():
+            if os.path.isdir(self.archive_dir):
+                for name in os.listdir(self.archive_dir):
+                    if name.endswith(tuple(_ARCHIVE_OPENERS)):
+                        os.remove(os.path.join(self.archive_dir, name))
 
+        self._submit(op, after=after)
+
+
+
+_managers: Dict[str, MemoryManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_memory(file_path: str = "History.json", **options: Any) -> MemoryManager:
+    """
+    Process-wide MemoryManager per history file. Streamlit reruns the script for
+    every interaction; sharing one instance keeps the group-commit queue and the
+    session snapshot cache alive across reruns and browser sessions.
+    `options` only apply when the manager is first created.
+    """
+    key = os.path.abspath(file_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = MemoryManager(file_path=file_path, **options)
+        return manager
@@ -0,0 +1,257 @@
+import sys
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Role table shared by all sessions; codes are stable for the life of the process.
+_ROLE_NAMES: List[str] = ["user", "assistant", "system"]
+_ROLE_CODES: Dict[str, int] = {name: i for i, name in enumerate(_ROLE_NAMES)}
+
+
+def role_code(role: str) -> int:
+    code = _ROLE_CODES.get(role)
+    if code is None:
+        if len(_ROLE_NAMES) >= 255:
+            raise ValueError("Too many distinct message roles.")
+        code = len(_ROLE_NAMES)
+        _ROLE_NAMES.append(sys.intern(role))
+        _ROLE_CODES[_ROLE_NAMES[code]] = code
+    return code
+
+
+def parse_timestamp_us(ts: Any) -> Optional[int]:
+    """ISO-8601 ('...Z' or naive UTC) to integer microseconds since the epoch."""
+    if not ts:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(ts).rstrip("Z"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def format_timestamp_us(us: int) -> str:
+    """Inverse of parse_timestamp_us, matching datetime.isoformat() + 'Z'."""
+    dt = datetime.fromtimestamp(us // 1_000_000, tz=timezone.utc).replace(microsecond=us % 1_000_000, tzinfo=None)
+    return dt.isoformat() + "Z"
+
+
+class Message:
+    """
+    Compact message record. Role and model strings are interned, the timestamp
+    is kept as integer microseconds, and rarely used keys live in `extra`.
+    Supports .get()/[] with the JSON key names so dict-based callers keep working.
+    """
+    __slots__ = ("id", "role", "content", "model", "ts_us", "pinned", "extra")
+
+    _CORE_KEYS = ("id", "role", "content", "model", "timestamp", "pinned")
+
+    def __init__(self, role: str, content: str, model: Optional[str] = None, ts_us: Optional[int] = None,
+                 id: Optional[str] = None, pinned: Optional[bool] = None, extra: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.role = sys.intern(role)
+        self.content = content
+        self.model = sys.intern(model) if model is not None else None
+        self.ts_us = ts_us
+        self.pinned = pinned
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Message":
+        extra = {k: v for k, v in d.items() if k not in cls._CORE_KEYS}
+        raw_ts = d.get("timestamp")
+        ts_us = parse_timestamp_us(raw_ts)
+        if raw_ts is not None and (ts_us is None or format_timestamp_us(ts_us) != raw_ts):
+            extra["timestamp"] = raw_ts  # keep non-canonical timestamps verbatim
+        return cls(
+            role=str(d.get("role", "user")),
+            content=d.get("content", ""),
+            model=d.get("model"),
+            ts_us=ts_us,
+            id=d.get("id"),
+            pinned=d.get("pinned"),
+            extra=extra,
+        )
+
+    @property
+    def timestamp(self) -> str:
+        if self.extra and "timestamp" in self.extra:
+            return self.extra["timestamp"]
+        return format_timestamp_us(self.ts_us) if self.ts_us is not None else ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {}
+        if self.id is not None:
+            d["id"] = self.id
+        d["role"] = self.role
+        d["content"] = self.content
+        if self.model is not None:
+            d["model"] = self.model
+        if self.ts_us is not None or (self.extra and "timestamp" in self.extra):
+            d["timestamp"] = self.timestamp
+        if self.pinned is not None:
+            d["pinned"] = self.pinned
+        if self.extra:
+            for k, v in self.extra.items():
+                if k != "timestamp":
+                    d[k] = v
+        return d
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "timestamp":
+            ts = self.timestamp
+            return ts if ts else default
+        if key in ("id", "role", "content", "model", "pinned"):
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def __getitem__(self, key: str) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, id={self.id!r}, content={self.content[:30]!r})"
+
+
+_PINNED = 1
+
+
+class Session(Sequence):
+    """
+    Columnar, read-only snapshot of a session: Message objects plus parallel
+    arrays of role codes, timestamps and flags used for filtering. Slices and
+    filters return SessionView objects that reference this session without copying.
+    """
+
+    def __init__(self, session_id: str, messages: Iterable[Message] = ()):
+        self.session_id = session_id
+        self._messages: List[Message] = []
+        self._roles = array("B")
+        self._ts = array("q")
+        self._flags = array("B")
+        for m in messages:
+            self._append(m)
+
+    @classmethod
+    def from_dicts(cls, session_id: str, dicts: Iterable[Dict[str, Any]]) -> "Session":
+        return cls(session_id, (Message.from_dict(d) for d in dicts))
+
+    def _append(self, m: Message):
+        self._messages.append(m)
+        self._roles.append(role_code(m.role))
+        self._ts.append(m.ts_us if m.ts_us is not None else 0)
+        self._flags.append(_PINNED if m.pinned else 0)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Message, "SessionView"]:
+        if isinstance(key, slice):
+            return self.view()[key]
+        return self._messages[key]
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def view(self) -> "SessionView":
+        return SessionView(self, 0, len(self._messages))
+
+    def last(self, n: int) -> "SessionView":
+        return SessionView(self, max(len(self._messages) - max(n, 0), 0), len(self._messages))
+
+    def filter(self, role: Optional[str] = None, roles: Optional[Iterable[str]] = None,
+               pinned_only: bool = False, query: str = "") -> "SessionView":
+        wanted = set()
+        if role is not None:
+            wanted.add(role_code(role))
+        if roles is not None:
+            wanted.update(role_code(r) for r in roles)
+        needle = query.lower() if query and query.strip() else ""
+        codes, flags, msgs = self._roles, self._flags, self._messages
+        idx = array("I")
+        for i in range(len(msgs)):
+            if wanted and codes[i] not in wanted:
+                continue
+            if pinned_only and not flags[i] & _PINNED:
+                continue
+            if needle and needle not in (msgs[i].content or "").lower():
+                continue
+            idx.append(i)
+        return SessionView(self, 0, len(idx), idx)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [m.to_dict() for m in self._messages]
+
+
+class SessionView(Sequence):
+    """
+    Window over a Session (a contiguous range, or a range over a filtered index array).
+    Slicing a view returns another view; nothing is copied until iterated.
+    """
+    __slots__ = ("session", "_start", "_stop", "_index")
+
+    def __init__(self, session: Session, start: int, stop: int, index: Optional[array] = None):
+        self.session = session
+        self._start = start
+        self._stop = max(stop, start)
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def _absolute(self, i: int) -> int:
+        return self._index[i] if self._index is not None else i
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Message, "SessionView"]:
+        n = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step != 1:
+                raise ValueError("SessionView only supports contiguous slices.")
+            return SessionView(self.session, self._start + start, self._start + max(stop, start), self._index)
+        if key < 0:
+            key += n
+        if not 0 <= key < n:
+            raise IndexError("SessionView index out of range")
+        return self.session._messages[self._absolute(self._start + key)]
+
+    def __iter__(self) -> Iterator[Message]:
+        msgs = self.session._messages
+        for i in range(self._start, self._stop):
+            yield msgs[self._absolute(i)]
+
+    def indices(self) -> List[int]:
+        """Absolute positions of the viewed messages in the session."""
+        if self._index is None:
+            return list(range(self._start, self._stop))
+        return self._index[self._start:self._stop].tolist()
+
+    def items(self) -> Iterator[tuple]:
+        """Yield (absolute_index, message) pairs."""
+        msgs = self.session._messages
+        for i in range(self._start, self._stop):
+            j = self._absolute(i)
+            yield j, msgs[j]
+
+    def timestamps_us(self) -> memoryview:
+        """Zero-copy view of the timestamps for a contiguous (unfiltered) window."""
+        if self._index is not None:
+            raise ValueError("Timestamps of a filtered view are not contiguous.")
+        return memoryview(self.session._ts)[self._start:self._stop]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [m.to_dict() for m in self]
@@ -4,11 +4,13 @@ Not used by the main app directly; prefer core/ollama_engine for integration.
 """
 if __name__ == "__main__":
     import requests
-    url = "http://localhost:11434/v1/completions"
+    url = "http://localhost:11434/api/generate"
     data = {
         "model": "gemma3:4b",
         "prompt": "Write a short poem about AI ",
-        "max_tokens": 150
+        "stream": False,
+        "keep_alive": "30m",
+        "options": {"num_predict": 150}
     }
     r = requests.post(url, json=data)
     print(r.json())
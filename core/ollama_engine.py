@@ -1,23 +1,102 @@
-from typing import Optional
+from typing import Optional, Any, Dict, List, Sequence, Tuple
+from collections import OrderedDict
 from .engine_base import BaseLLMEngine
+from .rate_limit import INTERACTIVE, get_governor
 import requests
+import hashlib
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Per-session KV context returned by /api/generate, shared across reruns in this process.
+# Keyed by (base_url, model, session_id) -> (history_key of the state it encodes, context tokens).
+_SESSION_CONTEXTS: "OrderedDict[Tuple[str, str, str], Tuple[str, List[int]]]" = OrderedDict()
+_SESSION_CONTEXTS_MAX = 64
+_contexts_lock = threading.Lock()
+_warmed: set = set()
+_warm_lock = threading.Lock()
+
+
 class OllamaEngine(BaseLLMEngine):
     """
-    Minimal Ollama HTTP wrapper.
+    Ollama HTTP wrapper.
     Expects Ollama running at provided base_url.
+    - api="native" uses /api/generate and /api/chat with keep_alive so the model stays loaded;
+      api="openai" keeps the old /v1/completions behaviour.
+    - warm_up() preloads the model; generate_in_session() reuses the returned `context`
+      so follow-up turns only pay prefill for the new text, until the context would no longer
+      fit in num_ctx (the model's context window, also sent with every request).
     """
 
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "gemma3:4b"):
+    def __init__(self, base_url: str = "http://localhost:11434", model: str = "gemma3:4b",
+                 num_parallel: int = 2, queue_timeout: float = 60.0, api: str = "native",
+                 keep_alive: Optional[str] = "30m", request_timeout: float = 120.0,
+                 num_ctx: Optional[int] = 4096):
+        if api not in ("native", "openai"):
+            raise ValueError("api must be 'native' or 'openai'.")
         self.base_url = base_url.rstrip("/")
         self.model = model
+        self.api = api
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.request_timeout = request_timeout
+        self.queue_timeout = queue_timeout
+        # Ollama serves OLLAMA_NUM_PARALLEL requests at once and queues the rest server-side.
+        self.governor = get_governor(f"ollama:{self.base_url}:{model}", max_concurrency=num_parallel)
+
+    def _options(self, max_tokens: Optional[int], temperature: Optional[float]) -> Dict[str, Any]:
+        options: Dict[str, Any] = {}
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if temperature is not None:
+            options["temperature"] = temperature
+        if self.num_ctx is not None:
+            options["num_ctx"] = self.num_ctx
+        return options
+
+    def _fits_context(self, context: List[int], turn_prompt: str, max_tokens: Optional[int]) -> bool:
+        """Whether the cached context plus the new turn and the reply still fit in num_ctx."""
+        if self.num_ctx is None:
+            return True
+        reply_budget = max_tokens if max_tokens is not None else self.num_ctx // 4
+        return len(context) + len(turn_prompt) // 4 + 1 + reply_budget <= self.num_ctx
+
+    def _post(self, path: str, payload: Dict[str, Any], priority: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self.governor.slot(priority, timeout=self.queue_timeout) as usage:
+            r = requests.post(f"{self.base_url}{path}", json=payload, timeout=timeout or self.request_timeout)
+            r.raise_for_status()
+            data = r.json()
+            # Native API reports eval_count; the OpenAI-compatible one reports usage.completion_tokens.
+            usage.output_tokens = data.get("eval_count") or (data.get("usage") or {}).get("completion_tokens")
+        return data
+
+    def _native_generate(self, prompt: str, context: Optional[List[int]], max_tokens: Optional[int],
+                         temperature: Optional[float], priority: int) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": self.model, "prompt": prompt, "stream": False}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if context:
+            payload["context"] = context
+        options = self._options(max_tokens, temperature)
+        if options:
+            payload["options"] = options
+        return self._post("/api/generate", payload, priority)
+
+    def generate(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 priority: int = INTERACTIVE) -> str:
+        try:
+            if self.api == "native":
+                data = self._native_generate(prompt, None, max_tokens, temperature, priority)
+                return str(data.get("response", ""))
+            return self._openai_generate(prompt, max_tokens, temperature, priority)
+        except Exception as e:
+            logger.exception("Ollama generate failed: %s", e)
+            raise
 
-    def generate(self, prompt: str, *, max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
-        url = f"{self.base_url}/v1/completions"
-        payload = {
+    def _openai_generate(self, prompt: str, max_tokens: Optional[int], temperature: Optional[float],
+                         priority: int) -> str:
+        payload: Dict[str, Any] = {
             "model": self.model,
             "prompt": prompt,
         }
@@ -25,18 +104,122 @@ class OllamaEngine(BaseLLMEngine):
             payload["max_tokens"] = max_tokens
         if temperature is not None:
             payload["temperature"] = temperature
+        data = self._post("/v1/completions", payload, priority, timeout=15)
+        if isinstance(data, dict) and "choices" in data and data["choices"]:
+            choice = data["choices"][0]
+            for key in ("text", "content", "message"):
+                if isinstance(choice, dict) and key in choice:
+                    return choice[key]
+            return str(choice)
+        return str(data)
+
+    def chat(self, messages: List[Dict[str, Any]], *, max_tokens: Optional[int] = None,
+             temperature: Optional[float] = None, priority: int = INTERACTIVE) -> str:
+        """
+        /api/chat with role/content messages. With the model kept alive, Ollama reuses
+        its KV cache for the unchanged message prefix.
+        """
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "messages": [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in messages],
+            "stream": False,
+        }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        options = self._options(max_tokens, temperature)
+        if options:
+            payload["options"] = options
         try:
-            r = requests.post(url, json=payload, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            if isinstance(data, dict) and "choices" in data and data["choices"]:
-                choice = data["choices"][0]
-                for key in ("text", "content", "message"):
-                    if isinstance(choice, dict) and key in choice:
-                        return choice[key]
-                return str(choice)
-            return str(data)
+            data = self._post("/api/chat", payload, priority)
+            return str((data.get("message") or {}).get("content", ""))
+        except Exception as e:
+            logger.exception("Ollama chat failed: %s", e)
+            raise
+
+    def generate_in_session(self, session_id: str, full_prompt: str, turn_prompt: str,
+                            history: Sequence[Any], frame: str = "", reuse: bool = True, *,
+                            max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                            priority: int = INTERACTIVE) -> Tuple[str, bool]:
+        """
+        Generate the next turn of a session, reusing the KV `context` from the previous turn.
+        `history` is the session including the new user message; `frame` identifies every
+        non-history part of the prompt (role, tone, rules; see PromptBuilder.frame_key).
+        The cached context is used only if it was produced for exactly history[:-1] under the
+        same frame and `reuse` is True (callers pass False when the turn carries extra
+        material such as attachment excerpts); then only `turn_prompt` is sent, otherwise
+        the full prompt is. Edits, deletions or setting changes therefore fall back to the
+        full prompt, and so does a context that has grown past num_ctx minus the reply
+        budget (the full prompt is trimmed by PromptBuilder; a stale context is not).
+        Returns (reply, reused_context).
+        """
+        if self.api != "native":
+            return self.generate(full_prompt, max_tokens=max_tokens, temperature=temperature, priority=priority), False
+        cache_key = (self.base_url, self.model, session_id)
+        with _contexts_lock:
+            cached = _SESSION_CONTEXTS.get(cache_key)
+        reuse = (reuse and cached is not None and cached[0] == history_key(history[:-1], frame)
+                 and self._fits_context(cached[1], turn_prompt, max_tokens))
+        try:
+            data = self._native_generate(turn_prompt if reuse else full_prompt, cached[1] if reuse else None,
+                                         max_tokens, temperature, priority)
         except Exception as e:
             logger.exception("Ollama generate failed: %s", e)
             raise
+        reply = str(data.get("response", ""))
+        context = data.get("context")
+        with _contexts_lock:
+            if context:
+                new_key = history_key(list(history) + [{"role": "assistant", "content": reply}], frame)
+                _SESSION_CONTEXTS[cache_key] = (new_key, context)
+                _SESSION_CONTEXTS.move_to_end(cache_key)
+                while len(_SESSION_CONTEXTS) > _SESSION_CONTEXTS_MAX:
+                    _SESSION_CONTEXTS.popitem(last=False)
+            else:
+                _SESSION_CONTEXTS.pop(cache_key, None)
+        return reply, reuse
+
+    def forget_session(self, session_id: str):
+        with _contexts_lock:
+            _SESSION_CONTEXTS.pop((self.base_url, self.model, session_id), None)
+
+    def warm_up(self, block: bool = False):
+        """
+        Load the model into memory (empty prompt) once per process so the first real
+        request does not pay the cold load. Runs in the background unless block=True.
+        """
+        if self.api != "native":
+            return
+        key = (self.base_url, self.model)
+        with _warm_lock:
+            if key in _warmed:
+                return
+            _warmed.add(key)
+
+        def run():
+            payload: Dict[str, Any] = {"model": self.model, "prompt": "", "stream": False}
+            if self.keep_alive is not None:
+                payload["keep_alive"] = self.keep_alive
+            if self.num_ctx is not None:
+                # Load with the same window real requests ask for, or the first one reloads the model.
+                payload["options"] = {"num_ctx": self.num_ctx}
+            try:
+                requests.post(f"{self.base_url}/api/generate", json=payload, timeout=self.request_timeout).raise_for_status()
+            except Exception as e:
+                logger.warning("Ollama warm-up failed: %s", e)
+                with _warm_lock:
+                    _warmed.discard(key)
+
+        if block:
+            run()
+        else:
+            threading.Thread(target=run, name="ollama-warmup", daemon=True).start()
+
 
+def history_key(messages: Sequence[Any], frame: str = "") -> str:
+    """Key identifying a conversation state: every message's role, content and attachments, plus the frame."""
+    h = hashlib.sha256(frame.encode("utf-8", "surrogatepass"))
+    for m in messages:
+        attached = ",".join(str(ref.get("id", "")) for ref in (m.get("attachments") or []))
+        h.update(b"\x1e")
+        h.update(f"{m.get('role', '')}\x1f{m.get('content', '')}\x1f{attached}".encode("utf-8", "surrogatepass"))
+    return h.hexdigest()[:24]
@@ -0,0 +1,50 @@
+"""
+Reports how much of each prompt is a byte-identical prefix of the previous turn's
+prompt, for the classic and prefix-stable layouts, over enough turns to pass the
+history cap (max_context_messages). Also reports how often the declared stable
+prefix really was a prefix of the next prompt. Not used by the main app directly.
+Run with: python -m core.prompt_bench
+"""
+import os
+
+from core.prompt_controller import PromptBuilder
+
+TURNS = [
+    "What is a Python decorator?",
+    "Can you show an example with arguments?",
+    "How does functools.wraps help here?",
+    "What about class-based decorators?",
+    "When would I use a decorator factory?",
+    "How do decorators interact with async functions?",
+    "Can I stack several decorators?",
+    "Summarize the key points so far.",
+]
+
+
+def common_prefix(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def run(layout: str, role: str = "coding_assistant", turns: int = 40):
+    history, prev, prev_stable, ratios, kept = [], None, 0, [], 0
+    for turn in range(turns):
+        question = f"{TURNS[turn % len(TURNS)]} (turn {turn})"
+        history.append({"role": "user", "content": question})
+        pb = PromptBuilder(topic=question, tone="friendly", user_name="dev", layout=layout)
+        pb.add_context_messages(history)
+        prompt, stable = pb.build_with_prefix(role)
+        if prev is not None:
+            ratios.append(common_prefix(prev, prompt) / len(prompt))
+            if prev_stable and prompt.startswith(prev[:prev_stable]):
+                kept += 1
+        prev, prev_stable = prompt, stable
+        history.append({"role": "assistant", "content": f"Answer {turn}: " + "details " * 40})
+    return ratios, kept
+
+
+if __name__ == "__main__":
+    for layout in ("classic", "prefix_stable"):
+        ratios, kept = run(layout)
+        per_turn = " ".join(f"{r:.2f}" for r in ratios)
+        print(f"{layout:14s} mean overlap {sum(ratios) / len(ratios):.2f}  "
+              f"stable prefix kept {kept}/{len(ratios)} turns\n  per turn: {per_turn}")
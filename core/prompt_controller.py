@@ -1,6 +1,22 @@
 # core/prompt_controller.py
-from dataclasses import dataclass, field
-from typing import Optional, Dict, List, Any
+import hashlib
+from dataclasses import dataclass, field, replace
+from typing import Optional, Dict, List, Any, Sequence, Tuple
+
+_DELIVERABLE = (
+    "Deliverable:\n"
+    "1) A concise direct answer (2-6 sentences) labeled 'Answer:'\n"
+    "2) An 'Expanded' section with examples, code, or step-by-step guidance if relevant.\n"
+    "If avoid_direct is ON, place the concise answer as a brief hint and put detailed steps in Expanded after user asks for full solution.\n"
+)
+
+
+@dataclass
+class PromptSegment:
+    name: str
+    text: str
+    stable: bool
+
 
 @dataclass
 class PromptBuilder:
@@ -10,6 +26,12 @@ class PromptBuilder:
     - context injection
     - instruction presets and safety wrappers
     - summarization helpers
+    - attachment excerpts pulled from an AttachmentStore within a token budget
+    - layout="prefix_stable" orders segments from most to least stable
+      (role template, rules, older history, recent history, current topic)
+      so consecutive turns share a byte-identical prefix for KV/context caching;
+      once history exceeds max_context_messages it is dropped in blocks of half the
+      cap, so the window start (and the prefix) only moves every few turns
     """
     topic: Optional[str] = None
     user_name: Optional[str] = None
@@ -20,6 +42,11 @@ class PromptBuilder:
     safety_instructions: Optional[str] = None
     output_format: Optional[str] = None 
     max_context_messages: int = 50
+    context_dropped: int = 0
+    layout: str = "classic"
+    recent_messages: int = 4
+    attachments: List[Tuple[str, str]] = field(default_factory=list)
+    attachment_budget_tokens: int = 1500
 
     role_templates: Dict[str, str] = field(default_factory=lambda: {
         "tutor": (
@@ -78,18 +105,30 @@ class PromptBuilder:
                     "Favor hints, guiding questions and scaffolded steps.")
         return "Instruction: Direct answers are allowed when appropriate."
 
-    def _build_context_text(self) -> str:
-        if not self.context_messages:
-            return ""
-        msgs = self.context_messages[-self.max_context_messages:]
-        lines = ["Conversation history (newest last):"]
-        for m in msgs:
+    def _context_window(self) -> List[Any]:
+        window = self.context_messages[-self.max_context_messages:]
+        if self.layout != "prefix_stable" or not self.context_dropped:
+            return window
+        # Align the window start to a block boundary in absolute message numbers.
+        total = self.context_dropped + len(self.context_messages)
+        block = max(self.max_context_messages // 2, 1)
+        start = -(-(total - self.max_context_messages) // block) * block
+        return window[max(start - (total - len(window)), 0):]
+
+    def _context_lines(self) -> List[str]:
+        lines = []
+        for m in self._context_window():
             role = str(m.get("role", "user")).capitalize()
             content = str(m.get("content", "")).strip()
             if len(content) > 1200:
                 content = content[:1180] + "…"
             lines.append(f"{role}: {content}")
-        return "\n".join(lines)
+        return lines
+
+    def _build_context_text(self) -> str:
+        if not self.context_messages:
+            return ""
+        return "\n".join(["Conversation history (newest last):"] + self._context_lines())
 
     def _build_extras_text(self) -> str:
         if not self.extras:
@@ -99,12 +138,91 @@ class PromptBuilder:
             lines.append(f"- {k}: {v}")
         return "\n".join(lines)
 
-    def build(self, role: str, custom_instructions: Optional[str] = None) -> str:
+    def _build_attachments_text(self) -> str:
+        if not self.attachments:
+            return ""
+        lines = ["Attached files (relevant excerpts):"]
+        for name, text in self.attachments:
+            lines.append(f"--- {name} ---\n{text.rstrip()}")
+        return "\n".join(lines)
+
+    def _template_for(self, role: str) -> str:
         role_key = role.lower()
         if role_key not in self.role_templates:
             raise ValueError(f"Unknown role '{role}'. Allowed: {list(self.role_templates.keys())}")
+        return self.role_templates[role_key]
+
+    def build_segments(self, role: str, custom_instructions: Optional[str] = None) -> List[PromptSegment]:
+        """
+        Prefix-stable layout as ordered segments. Segments flagged stable form the
+        cacheable prefix; everything after them changes from turn to turn.
+        """
+        template = self._template_for(role)
+        static_lines, topic_lines = [], []
+        for line in template.splitlines():
+            if "{topic}" in line:
+                topic_lines.append(line)
+                continue
+            line = line.replace("{context}", "").replace("{extras}", "")
+            if line.strip():
+                static_lines.append(line)
+        system = "\n".join(static_lines).format(avoid_direct=self._avoid_direct_text(), tone=self.tone) + "\n"
 
-        template = self.role_templates[role_key]
+        rules = []
+        if self.user_name:
+            rules.append(f"User: {self.user_name}\n")
+        if self.output_format:
+            rules.append(f"Desired format: {self.output_format}\n")
+        if self.safety_instructions:
+            rules.append(f"Safety rules: {self.safety_instructions}\n")
+        rules.append(_DELIVERABLE)
+
+        history = self._context_lines()
+        split = max(len(history) - max(self.recent_messages, 0), 0)
+        older = "".join(f"{line}\n" for line in history[:split])
+        recent = "".join(f"{line}\n" for line in history[split:])
+        if history:
+            older = "\nConversation history (newest last):\n" + older
+
+        turn = []
+        attached = self._build_attachments_text()
+        if attached:
+            turn.append(f"\n{attached}\n")
+        extras = self._build_extras_text()
+        if extras:
+            turn.append(f"\n{extras}\n")
+        if custom_instructions:
+            turn.append(f"\nCustom instructions: {custom_instructions}\n")
+        if topic_lines:
+            topic = self.topic or "<no topic provided>"
+            turn.append("\n" + "\n".join(line.format(topic=topic) for line in topic_lines) + "\n")
+
+        return [
+            PromptSegment("system", system, True),
+            PromptSegment("rules", "\n" + "\n".join(rules), True),
+            PromptSegment("history_older", older, True),
+            PromptSegment("history_recent", recent, False),
+            PromptSegment("turn", "".join(turn), False),
+        ]
+
+    def build_with_prefix(self, role: str, custom_instructions: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Build the prompt and return (prompt, stable_prefix_length). In the classic
+        layout no prefix is guaranteed stable, so the length is 0.
+        """
+        if self.layout != "prefix_stable":
+            return self._build_classic(role, custom_instructions), 0
+        segments = self.build_segments(role, custom_instructions)
+        prefix = "".join(seg.text for seg in segments if seg.stable)
+        return prefix + "".join(seg.text for seg in segments if not seg.stable), len(prefix)
+
+    def build(self, role: str, custom_instructions: Optional[str] = None) -> str:
+        if self.layout == "prefix_stable":
+            return self.build_with_prefix(role, custom_instructions)[0]
+        return self._build_classic(role, custom_instructions)
+
+    def _build_classic(self, role: str, custom_instructions: Optional[str] = None) -> str:
+        template = self._template_for(role)
 
         prompt = template.format(
             avoid_direct=self._avoid_direct_text(),
@@ -122,18 +240,25 @@ class PromptBuilder:
         if self.safety_instructions:
             prompt += f"\nSafety rules: {self.safety_instructions}\n"
 
+        attached = self._build_attachments_text()
+        if attached:
+            prompt += f"\n{attached}\n"
+
         if custom_instructions:
             prompt += f"\nCustom instructions: {custom_instructions}\n"
 
-        prompt += (
-            "\nDeliverable:\n"
-            "1) A concise direct answer (2-6 sentences) labeled 'Answer:'\n"
-            "2) An 'Expanded' section with examples, code, or step-by-step guidance if relevant.\n"
-            "If avoid_direct is ON, place the concise answer as a brief hint and put detailed steps in Expanded after user asks for full solution.\n"
-        )
+        prompt += "\n" + _DELIVERABLE
 
         return prompt
 
+    def frame_key(self, role: str, custom_instructions: Optional[str] = None) -> str:
+        """
+        Hash of everything in the prompt except history, topic and attachments (role
+        template, tone, rules, extras). Equal keys mean only the conversation moved on.
+        """
+        frame = replace(self, topic="", context_messages=[], context_dropped=0, attachments=[])
+        return hashlib.sha256(frame.build(role, custom_instructions).encode("utf-8")).hexdigest()[:24]
+
     def add_role_template(self, role_name: str, template_text: str, overwrite: bool = False):
         key = role_name.lower()
         if key in self.role_templates and not overwrite:
@@ -146,15 +271,32 @@ class PromptBuilder:
     def clear_extras(self):
         self.extras.clear()
 
-    def add_context_messages(self, messages: List[Dict[str, Any]]):
+    def add_context_messages(self, messages: Sequence[Any]):
+        """
+        Accepts dicts or core.message.Message objects (any sequence, e.g. a SessionView).
+        Only the newest max_context_messages are copied.
+        """
         if not messages:
             return
         existing = self.context_messages or []
-        combined = existing + messages
+        total = self.context_dropped + len(existing) + len(messages)
+        combined = existing + list(messages[-self.max_context_messages:])
         self.context_messages = combined[-self.max_context_messages:]
+        self.context_dropped = total - len(self.context_messages)
+
+    def add_attachments(self, store: Any, refs: Sequence[Dict[str, Any]], query: Optional[str] = None):
+        """
+        Pull excerpts of the referenced attachments from `store` (core.attachments.AttachmentStore),
+        preferring chunks relevant to `query` (defaults to the topic), within attachment_budget_tokens.
+        """
+        if not refs:
+            return
+        self.attachments = store.excerpt(refs, query if query is not None else (self.topic or ""),
+                                         budget_tokens=self.attachment_budget_tokens)
 
     def clear_context(self):
         self.context_messages.clear()
+        self.context_dropped = 0
 
     def build_for_definition(self, role: str = "coding_assistant", custom: Optional[str] = None) -> str:
         self.avoid_direct_answer = False
@@ -167,9 +309,10 @@ class PromptBuilder:
         return self.build(role, custom)
 
     @staticmethod
-    def summarization_prompt(messages: List[Dict[str, Any]], length: str = "short") -> str:
+    def summarization_prompt(messages: List[Dict[str, Any]], length: str = "short",
+                             max_messages: Optional[int] = 30) -> str:
         snippet = []
-        for m in messages[-30:]:
+        for m in (messages[-max_messages:] if max_messages else messages):
             role = str(m.get("role", "user")).upper()
             content = str(m.get("content", "")).strip()
             snippet.append(f"{role}: {content}")
@@ -179,3 +322,33 @@ class PromptBuilder:
             f"{joined}\n\n"
             "Output format:\nSummary:\n- <one or two lines>\nAction items:\n1)\n2)\n3)\n"
         )
+
+    @staticmethod
+    def chunk_summary_prompt(messages: Sequence[Any]) -> str:
+        """Map step: summarize one slice of a long conversation."""
+        lines = []
+        for m in messages:
+            lines.append(f"{str(m.get('role', 'user')).upper()}: {str(m.get('content', '')).strip()}")
+        joined = "\n".join(lines)
+        return (
+            "Summarize this part of a longer conversation in 3-6 bullet points. Keep decisions, facts, "
+            "open questions and requested follow-ups; drop pleasantries.\n\n"
+            f"{joined}\n\nBullets:\n"
+        )
+
+    @staticmethod
+    def reduce_summary_prompt(summaries: Sequence[str], final: bool = False, length: str = "short") -> str:
+        """Reduce step: merge partial summaries (in chronological order) into one."""
+        parts = "\n\n".join(f"Part {i + 1}:\n{s.strip()}" for i, s in enumerate(summaries))
+        if final:
+            return (
+                f"These are summaries of consecutive parts of one conversation. Combine them into a {length} "
+                "summary (2-4 sentences) and list 3 action-items.\n\n"
+                f"{parts}\n\n"
+                "Output format:\nSummary:\n- <one or two lines>\nAction items:\n1)\n2)\n3)\n"
+            )
+        return (
+            "These are summaries of consecutive parts of one conversation. Merge them into 4-8 bullet points, "
+            "keeping the chronological order.\n\n"
+            f"{parts}\n\nBullets:\n"
+        )
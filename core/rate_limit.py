@@ -0,0 +1,234 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class RateLimitTimeout(TimeoutError):
+    """Raised when a request could not be admitted before its deadline."""
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """
+    True for provider-side overload / quota errors (HTTP 429 or 503), whether they come
+    from requests (HTTPError.response.status_code) or from SDK exceptions carrying a code.
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        code = getattr(exc, "code", None)
+        status = code() if callable(code) else code
+        status = getattr(status, "value", status)
+    if isinstance(status, (list, tuple)):  # grpc StatusCode values look like (8, 'resource exhausted')
+        if status and status[0] in (8, 14):  # RESOURCE_EXHAUSTED / UNAVAILABLE
+            return True
+        status = None
+    if status in (429, 503):
+        return True
+    name = type(exc).__name__
+    return name in ("ResourceExhausted", "ServiceUnavailable", "TooManyRequests")
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class SlotUsage:
+    """Filled in by the caller inside EngineGovernor.slot() so latency can be normalized."""
+    __slots__ = ("output_tokens",)
+
+    def __init__(self):
+        self.output_tokens: Optional[int] = None
+
+
+class EngineGovernor:
+    """
+    Client-side admission control for one engine, shared by every session in the process.
+    - token bucket: at most `rate` requests/second with bursts up to `burst` (rate=None disables)
+    - AIMD concurrency: the in-flight limit grows by ~1 per window of successes and is
+      cut multiplicatively on 429/503 or when latency rises well above its baseline.
+      Latency is measured per output token (when the caller reports it, floored at
+      `min_tokens` so fixed overhead does not dominate short replies) against an EWMA
+      baseline, so long answers on a healthy server are not mistaken for overload
+    - waiters are served by priority (lower first, INTERACTIVE before BACKGROUND), then
+      FIFO; a waiter whose deadline passes gets RateLimitTimeout
+    """
+
+    def __init__(self, name: str, rate: Optional[float] = None, burst: int = 1,
+                 min_concurrency: int = 1, max_concurrency: int = 4, initial_concurrency: Optional[int] = None,
+                 latency_tolerance: float = 2.5, overload_backoff: float = 1.0,
+                 latency_alpha: float = 0.1, latency_warmup: int = 5, min_tokens: int = 32):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(initial_concurrency or self.max_concurrency)
+        self.latency_tolerance = latency_tolerance
+        self.overload_backoff = overload_backoff
+        self.latency_alpha = latency_alpha
+        self.latency_warmup = latency_warmup
+        self.min_tokens = max(1, min_tokens)
+
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._blocked_until = 0.0
+        self._in_flight = 0
+        self._latency_baseline: Optional[float] = None
+        self._latency_samples = 0
+        self._cond = threading.Condition()
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self.counters: Dict[str, int] = {
+            "requests": 0, "admitted": 0, "succeeded": 0, "failed": 0,
+            "overloaded": 0, "slow": 0, "deadline_exceeded": 0,
+        }
+
+    # ---------- admission ----------
+
+    def _refill(self, now: float):
+        if self.rate is None:
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _wait_needed(self, now: float) -> float:
+        """0 if a request may start now, else seconds until it might."""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= int(self.limit):
+            return float("inf")  # woken by release()
+        if self.rate is not None:
+            self._refill(now)
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+        return 0.0
+
+    def acquire(self, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self.counters["requests"] += 1
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_needed(now) if self._waiters[0] == entry else float("inf")
+                    if wait <= 0:
+                        heapq.heappop(self._waiters)
+                        if self.rate is not None:
+                            self._tokens -= 1
+                        self._in_flight += 1
+                        self.counters["admitted"] += 1
+                        self._cond.notify_all()  # let the next waiter re-check
+                        return
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self._waiters.remove(entry)
+                            heapq.heapify(self._waiters)
+                            self.counters["deadline_exceeded"] += 1
+                            self._cond.notify_all()
+                            raise RateLimitTimeout(f"{self.name}: request not admitted within {timeout:.1f}s")
+                        wait = min(wait, remaining)
+                    self._cond.wait(None if wait == float("inf") else wait)
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+
+    def release(self, latency: Optional[float] = None, error: Optional[BaseException] = None,
+                output_tokens: Optional[int] = None):
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            if error is not None and is_overload_error(error):
+                self.counters["overloaded"] += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                pause = retry_after_seconds(error) or self.overload_backoff
+                self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            elif error is not None:
+                self.counters["failed"] += 1
+            else:
+                self.counters["succeeded"] += 1
+                if latency is not None:
+                    if output_tokens is not None:
+                        latency /= max(output_tokens, self.min_tokens)
+                    self._observe_latency(latency)
+            self._cond.notify_all()
+
+    def _observe_latency(self, latency: float):
+        base = self._latency_baseline
+        warmed_up = self._latency_samples >= self.latency_warmup
+        if warmed_up and base is not None and latency > base * self.latency_tolerance:
+            self.counters["slow"] += 1
+            self.limit = max(self.min_concurrency, self.limit * 0.8)
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+        # EWMA baseline (plain mean during warm-up).
+        self._latency_samples += 1
+        if base is None:
+            self._latency_baseline = latency
+        elif not warmed_up:
+            self._latency_baseline = base + (latency - base) / self._latency_samples
+        else:
+            self._latency_baseline = base + self.latency_alpha * (latency - base)
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> Iterator[SlotUsage]:
+        """Hold a request slot; set `usage.output_tokens` inside the block when known."""
+        self.acquire(priority, timeout)
+        usage = SlotUsage()
+        started = time.monotonic()
+        try:
+            yield usage
+        except BaseException as e:
+            self.release(error=e)
+            raise
+        else:
+            self.release(latency=time.monotonic() - started, output_tokens=usage.output_tokens)
+
+    def call(self, fn: Callable[[], Any], priority: int = INTERACTIVE, timeout: Optional[float] = None) -> Any:
+        with self.slot(priority, timeout):
+            return fn()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            stats: Dict[str, Any] = dict(self.counters)
+            stats.update(
+                limit=round(self.limit, 2), in_flight=self._in_flight, queued=len(self._waiters),
+                latency_baseline=self._latency_baseline,
+            )
+            return stats
+
+
+_governors: Dict[str, EngineGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(name: str, **kwargs) -> EngineGovernor:
+    """
+    Process-wide governor for an engine key; kwargs only apply on first creation.
+    """
+    with _governors_lock:
+        gov = _governors.get(name)
+        if gov is None:
+            gov = EngineGovernor(name, **kwargs)
+            _governors[name] = gov
+        return gov
+
+
+def all_governors() -> Dict[str, EngineGovernor]:
+    with _governors_lock:
+        return dict(_governors)
@@ -0,0 +1,69 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+
+@dataclass(frozen=True)
+class RenderedMessage:
+    """
+    Pre-rendered pieces of a single message bubble.
+    code_blocks holds (part_index, code) pairs so widget keys stay stable.
+    """
+    html: str
+    code_blocks: Tuple[Tuple[int, str], ...] = ()
+
+
+def extract_code_blocks(content: str) -> Tuple[Tuple[int, str], ...]:
+    if not content or "```" not in content:
+        return ()
+    parts = content.split("```")
+    return tuple((i, parts[i].strip()) for i in range(1, len(parts), 2))
+
+
+def content_hash(content: str) -> str:
+    return hashlib.blake2b((content or "").encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of rendered message HTML and parsed code blocks.
+    Keyed by (message id, content hash, search query, theme) so edits and
+    new searches miss naturally while unchanged messages are a dict lookup.
+    """
+
+    def __init__(self, highlighter: Callable[[str, str], str], max_entries: int = 512):
+        self.highlighter = highlighter
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, RenderedMessage]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, message_id: str, content: str, query: str = "", theme: str = "") -> RenderedMessage:
+        key = (message_id, content_hash(content), query or "", theme)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+        rendered = RenderedMessage(
+            html=self.highlighter(content, query),
+            code_blocks=extract_code_blocks(content),
+        )
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = rendered
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return rendered
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,325 @@
+import atexit
+import json
+import logging
+import math
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Runs inside each pre-started worker: wait for one job, apply limits, run it, exit.
+_WORKER_SOURCE = r'''
+import json, os, sys, traceback
+try:
+    import resource
+except ImportError:
+    resource = None
+line = sys.stdin.readline()
+if not line:
+    sys.exit(0)
+job = json.loads(line)
+
+
+def user_tasks():
+    # RLIMIT_NPROC counts every process/thread of the user, so the cap is relative to now.
+    uid, count = os.getuid(), 0
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            try:
+                if os.stat("/proc/" + pid).st_uid == uid:
+                    count += len(os.listdir("/proc/%s/task" % pid))
+            except OSError:
+                pass
+    return count
+
+
+nproc = None
+if job.get("extra_processes") and os.path.isdir("/proc"):
+    nproc = user_tasks() + job["extra_processes"]
+if resource is not None:
+    for name, value in (("RLIMIT_CPU", job.get("cpu_seconds")),
+                        ("RLIMIT_NPROC", nproc),
+                        ("RLIMIT_AS", job.get("memory_bytes")),
+                        ("RLIMIT_FSIZE", job.get("file_size_bytes"))):
+        if value and hasattr(resource, name):
+            try:
+                # One extra second of hard CPU limit so SIGXCPU (not SIGKILL) arrives first.
+                hard = value + 1 if name == "RLIMIT_CPU" else value
+                resource.setrlimit(getattr(resource, name), (value, hard))
+            except (ValueError, OSError):
+                pass
+sys.stdin = open(os.devnull)
+try:
+    code = compile(job["code"], "<snippet>", "exec")
+    exec(code, {"__name__": "__main__", "__builtins__": __builtins__})
+except SystemExit:
+    raise
+except BaseException:
+    traceback.print_exc()
+    sys.exit(1)
+'''
+
+
+@dataclass
+class SandboxLimits:
+    """
+    Per-snippet resource limits. Values of 0 disable the corresponding limit;
+    cpu_seconds=None derives the CPU limit from the run's timeout.
+    """
+    timeout: float = 10.0
+    cpu_seconds: Optional[int] = None
+    memory_mb: int = 256
+    file_size_mb: int = 5
+    extra_processes: int = 16  # processes/threads a snippet may start (Linux)
+    max_output_chars: int = 200_000
+
+
+def _signal_message(signum: int) -> str:
+    if signum == getattr(signal, "SIGXCPU", None):
+        return "Execution stopped: CPU time limit exceeded."
+    if signum == getattr(signal, "SIGXFSZ", None):
+        return "Execution stopped: file size limit exceeded."
+    if signum == getattr(signal, "SIGKILL", None):
+        return "Execution killed (possibly out of memory)."
+    try:
+        name = signal.Signals(signum).name
+    except ValueError:
+        name = f"signal {signum}"
+    return f"Execution terminated by {name}."
+
+
+class _Worker:
+    def __init__(self):
+        self.workdir = tempfile.mkdtemp(prefix="jarvis_sandbox_")
+        env = {"PATH": os.environ.get("PATH", ""), "PYTHONIOENCODING": "utf-8"}
+        self.proc = subprocess.Popen(
+            [sys.executable, "-I", "-u", "-c", _WORKER_SOURCE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.workdir,
+            env=env,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            # Own process group, so anything the snippet spawns can be killed with it.
+            start_new_session=os.name == "posix",
+        )
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def kill_group(self):
+        """Kill the worker and everything it started (children keep our pipes open)."""
+        if os.name == "posix":
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+                return
+            except (ProcessLookupError, PermissionError):
+                pass
+        if self.proc.poll() is None:
+            try:
+                self.proc.kill()
+            except OSError:
+                pass
+
+    def dispose(self, readers: Sequence[threading.Thread] = ()):
+        self.kill_group()
+        try:
+            self.proc.wait(timeout=2)
+        except Exception:
+            pass
+        # Closing a pipe while a reader is inside readline() blocks, so join them first.
+        for t in readers:
+            t.join(timeout=2)
+        streams = [self.proc.stdin]
+        if not any(t.is_alive() for t in readers):
+            streams += [self.proc.stdout, self.proc.stderr]
+        else:
+            logger.warning("Sandbox output pipes still held open after kill; leaving them to the GC.")
+        for stream in streams:
+            try:
+                if stream:
+                    stream.close()
+            except Exception:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class SandboxPool:
+    """
+    Pool of warm, single-use Python worker processes for running snippets.
+    Each worker runs exactly one snippet under resource limits and is then
+    discarded; a replacement is started in the background so the next run
+    only pays IPC cost instead of interpreter startup.
+    """
+
+    def __init__(self, size: int = 2, limits: Optional[SandboxLimits] = None):
+        self.size = max(1, size)
+        self.limits = limits or SandboxLimits()
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._refill()
+
+    def _spawn(self) -> Optional[_Worker]:
+        try:
+            return _Worker()
+        except Exception:
+            logger.exception("Failed to start sandbox worker")
+            return None
+
+    def _refill(self):
+        with self._lock:
+            self._idle = [w for w in self._idle if w.alive()]
+            missing = 0 if self._closed else self.size - len(self._idle)
+        for _ in range(missing):
+            worker = self._spawn()
+            if worker is None:
+                return
+            with self._lock:
+                if self._closed:
+                    worker.dispose()
+                    return
+                self._idle.append(worker)
+
+    def _refill_async(self):
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.dispose()
+        worker = self._spawn()
+        if worker is None:
+            raise RuntimeError("Could not start a sandbox worker process.")
+        return worker
+
+    def run(self, code: str, *, timeout: Optional[float] = None,
+            on_output: Optional[Callable[[str, str], None]] = None) -> Dict[str, str]:
+        """
+        Run `code` in a warm worker and return {"stdout", "stderr", "rc"}.
+        on_output(stream_name, text) is called from the calling thread as output arrives.
+        """
+        if self._closed:
+            raise RuntimeError("Sandbox pool is closed.")
+        limits = self.limits
+        timeout = limits.timeout if timeout is None else timeout
+        worker = self._acquire()
+        self._refill_async()
+
+        events: "queue.Queue[tuple]" = queue.Queue()
+
+        def pump(name: str, stream):
+            try:
+                for chunk in iter(lambda: stream.readline(), ""):
+                    events.put((name, chunk))
+            except Exception:
+                pass
+            finally:
+                events.put((name, None))
+
+        readers = [
+            threading.Thread(target=pump, args=("stdout", worker.proc.stdout), daemon=True),
+            threading.Thread(target=pump, args=("stderr", worker.proc.stderr), daemon=True),
+        ]
+        for t in readers:
+            t.start()
+
+        # The CPU limit sits just past the wall-clock timeout so a busy loop is
+        # reported as a timeout instead of dying from SIGXCPU first.
+        cpu_seconds = math.ceil(timeout) + 1 if limits.cpu_seconds is None else limits.cpu_seconds
+        job = {
+            "code": code,
+            "cpu_seconds": cpu_seconds,
+            "memory_bytes": limits.memory_mb * 1024 * 1024,
+            "file_size_bytes": limits.file_size_mb * 1024 * 1024,
+            "extra_processes": limits.extra_processes,
+        }
+        out: Dict[str, List[str]] = {"stdout": [], "stderr": []}
+        sizes = {"stdout": 0, "stderr": 0}
+        timed_out = False
+        try:
+            worker.proc.stdin.write(json.dumps(job) + "\n")
+            worker.proc.stdin.close()
+            deadline = time.monotonic() + timeout
+            open_streams = 2
+            group_killed = False
+            while open_streams:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                try:
+                    name, chunk = events.get(timeout=min(remaining, 0.1))
+                except queue.Empty:
+                    # The worker is done but a leftover child still holds the pipes.
+                    if not group_killed and worker.proc.poll() is not None:
+                        worker.kill_group()
+                        group_killed = True
+                    continue
+                if chunk is None:
+                    open_streams -= 1
+                    continue
+                if sizes[name] < limits.max_output_chars:
+                    chunk = chunk[:limits.max_output_chars - sizes[name]]
+                    sizes[name] += len(chunk)
+                    out[name].append(chunk)
+                    if on_output is not None:
+                        on_output(name, chunk)
+            if not timed_out:
+                try:
+                    worker.proc.wait(timeout=max(deadline - time.monotonic(), 0.1))
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+        except (BrokenPipeError, OSError) as e:
+            worker.dispose(readers)
+            return {"stdout": "", "stderr": f"Execution failed: {e}", "rc": "-1"}
+
+        if timed_out:
+            worker.dispose(readers)
+            stderr = "".join(out["stderr"]) + "Execution timed out."
+            return {"stdout": "".join(out["stdout"]), "stderr": stderr, "rc": "-1"}
+
+        rc = worker.proc.returncode
+        worker.dispose(readers)
+        stderr = "".join(out["stderr"])
+        if rc is not None and rc < 0:
+            stderr += _signal_message(-rc)
+        return {"stdout": "".join(out["stdout"]), "stderr": stderr, "rc": str(rc)}
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.dispose()
+
+
+_default_pool: Optional[SandboxPool] = None
+_default_lock = threading.Lock()
+
+
+def get_default_pool() -> SandboxPool:
+    """
+    Process-wide pool shared by all Streamlit sessions.
+    """
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = SandboxPool()
+            atexit.register(_default_pool.close)
+        return _default_pool
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Sequence
+
+from .prompt_controller import PromptBuilder
+from .rate_limit import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) good enough for budgeting."""
+    return len(text or "") // 4 + 1
+
+
+def _message_line(m: Any) -> str:
+    return f"{str(m.get('role', 'user')).upper()}: {str(m.get('content', '')).strip()}"
+
+
+def _split_oversized(m: Any, token_budget: int) -> List[Any]:
+    """Cut a message that alone exceeds the budget into budget-sized parts."""
+    content = str(m.get("content", ""))
+    if estimate_tokens(_message_line(m)) <= token_budget:
+        return [m]
+    role = str(m.get("role", "user"))
+    width = max((token_budget - 16) * 4, 200)
+    total = -(-len(content) // width)
+    return [{"role": role, "content": f"[part {i + 1}/{total}] {content[i * width:(i + 1) * width]}"}
+            for i in range(total)]
+
+
+def chunk_messages(messages: Sequence[Any], token_budget: int) -> List[List[Any]]:
+    """
+    Greedy chunking from the start of the session. Earlier chunk boundaries do not move
+    when messages are appended, so their cached summaries stay valid. A message larger
+    than the budget (e.g. a pasted file) is split into parts first.
+    """
+    chunks: List[List[Any]] = []
+    current: List[Any] = []
+    used = 0
+    for m in (part for msg in messages for part in _split_oversized(msg, token_budget)):
+        cost = estimate_tokens(_message_line(m))
+        if current and used + cost > token_budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(m)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class SummaryCache:
+    """Bounded, thread-safe LRU of summaries keyed by content hash."""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_default_cache = SummaryCache()
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes sessions of any length: chunk by token budget, summarize chunks
+    concurrently (map), then merge the partial summaries level by level (reduce).
+    Chunk and merge results are cached by content hash, so re-summarizing a grown
+    session only calls the engine for chunks that changed.
+    """
+
+    def __init__(self, engine, chunk_tokens: int = 2000, fan_in: int = 6, max_workers: int = 4,
+                 chunk_max_tokens: int = 256, final_max_tokens: int = 300, priority: int = BACKGROUND,
+                 cache: Optional[SummaryCache] = None):
+        self.engine = engine
+        self.chunk_tokens = chunk_tokens
+        self.fan_in = max(2, fan_in)
+        self.max_workers = max(1, max_workers)
+        self.chunk_max_tokens = chunk_max_tokens
+        self.final_max_tokens = final_max_tokens
+        self.priority = priority
+        self.cache = cache or _default_cache
+        self.engine_calls = 0
+        self._calls_lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind: str, text: str) -> str:
+        return kind + ":" + hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def _generate(self, kind: str, prompt: str, max_tokens: int) -> str:
+        key = self._key(kind, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._calls_lock:
+            self.engine_calls += 1
+        result = (self.engine.generate(prompt, max_tokens=max_tokens, temperature=0.0, priority=self.priority) or "").strip()
+        self.cache.put(key, result)
+        return result
+
+    def _map(self, kind: str, prompts: List[str], max_tokens: int) -> List[str]:
+        if len(prompts) == 1:
+            return [self._generate(kind, prompts[0], max_tokens)]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(prompts))) as pool:
+            return list(pool.map(lambda p: self._generate(kind, p, max_tokens), prompts))
+
+    def summarize(self, messages: Sequence[Any], length: str = "short") -> str:
+        if not messages:
+            return ""
+        chunks = chunk_messages(messages, self.chunk_tokens)
+        if len(chunks) == 1:
+            prompt = PromptBuilder.summarization_prompt(chunks[0], length=length, max_messages=None)
+            return self._generate("final", prompt, self.final_max_tokens)
+
+        level = self._map("chunk", [PromptBuilder.chunk_summary_prompt(c) for c in chunks], self.chunk_max_tokens)
+        while len(level) > self.fan_in:
+            groups = [level[i:i + self.fan_in] for i in range(0, len(level), self.fan_in)]
+            level = self._map("merge", [PromptBuilder.reduce_summary_prompt(g) for g in groups], self.chunk_max_tokens)
+        prompt = PromptBuilder.reduce_summary_prompt(level, final=True, length=length)
+        return self._generate("final", prompt, self.final_max_tokens)
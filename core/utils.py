@@ -1,15 +1,15 @@
 import re
-from typing import Iterable
+from functools import lru_cache
+from typing import Iterable, Tuple
+
+from .command_engine import DEFAULT_COMMAND_PHRASES, default_registry
+
+
+@lru_cache(maxsize=32)
+def _phrase_matcher(phrases: Tuple[str, ...]) -> "re.Pattern":
+    ordered = sorted({p.lower() for p in phrases if p}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(p) for p in ordered) or r"(?!)")
 
-DEFAULT_COMMAND_PHRASES = [
-    "open google",
-    "open youtube",
-    "search google",
-    "search youtube",
-    "google ",
-    "youtube ",
-    "search ",
-]
 
 def is_command(text: str, extra_phrases: Iterable[str] = ()) -> bool:
     """
@@ -18,10 +18,7 @@ def is_command(text: str, extra_phrases: Iterable[str] = ()) -> bool:
     """
     if not text:
         return False
-    txt = text.lower().strip()
-    for p in list(DEFAULT_COMMAND_PHRASES) + list(extra_phrases):
-        if p and p in txt:
-            return True
-    if re.search(r"\b(open|visit|search|find|google|youtube)\b", txt):
+    if default_registry().match(text) is not None:
         return True
-    return False
+    extra = tuple(extra_phrases)
+    return bool(extra) and _phrase_matcher(extra).search(text.lower().strip()) is not None
@@ -6,10 +6,203 @@ try:
 except Exception:
     HAS_VOICE = False
 
+import queue
+import re
 import threading
+from typing import Callable, Iterable, List, Optional
 
 logger = logging.getLogger(__name__)
 
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|(?<=[.!?…][\"')\]])\s+|\n{2,}")
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text at sentence boundaries (., !, ?, … followed by whitespace, or blank lines).
+    """
+    return [s.strip() for s in _SENTENCE_END.split(text or "") if s and s.strip()]
+
+
+class SentenceBuffer:
+    """
+    Accumulates streamed text and releases complete sentences as they arrive.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        self._pending += chunk or ""
+        last_end = None
+        for m in _SENTENCE_END.finditer(self._pending):
+            last_end = m.end()
+        if last_end is None:
+            return []
+        ready, self._pending = self._pending[:last_end], self._pending[last_end:]
+        return split_sentences(ready)
+
+    def flush(self) -> List[str]:
+        rest, self._pending = self._pending, ""
+        return split_sentences(rest)
+
+
+class Pyttsx3Driver:
+    """
+    Adapter for a pyttsx3 engine. Only the speech worker thread touches it.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def speak(self, sentence: str):
+        self.engine.say(sentence)
+        self.engine.runAndWait()
+
+    def stop(self):
+        try:
+            self.engine.stop()
+        except Exception:
+            logger.exception("TTS stop failed")
+
+
+class FileDriver:
+    """
+    Offline fake driver: 'renders' each sentence as a line in a text file.
+    Useful for tests and for measuring time-to-first-sentence without audio.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        open(self.path, "w", encoding="utf-8").close()
+
+    def speak(self, sentence: str):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(sentence.replace("\n", " ") + "\n")
+
+    def stop(self):
+        pass
+
+
+class SpeechQueue:
+    """
+    Single long-lived TTS worker fed by a bounded queue.
+    - speak() hands a whole response to the worker as one item, so it never waits
+      on sentence-level backpressure; the worker speaks it sentence by sentence
+    - feed() enqueues each completed sentence of a streamed answer; when the queue
+      is full the producer blocks until there is room (nothing is dropped)
+    - cancel() drops everything queued, stops the current utterance and releases
+      any blocked producer
+    - skip() stops only the current utterance
+    """
+
+    def __init__(self, driver, max_pending: int = 32, poll_interval: float = 0.1):
+        self.driver = driver
+        self.poll_interval = poll_interval
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max_pending)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stream = SentenceBuffer()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="jarvis-tts", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                generation, sentences = item
+                self._idle.clear()
+                for sentence in sentences:
+                    if generation != self._generation:
+                        break
+                    try:
+                        self.driver.speak(sentence)
+                    except Exception:
+                        logger.exception("TTS speak failed")
+            finally:
+                self._queue.task_done()
+                if self._queue.empty():
+                    self._idle.set()
+
+    def _put(self, generation: int, sentences: List[str]) -> bool:
+        """Block until the item fits; give up only if cancelled or closed meanwhile."""
+        while not self._closed and generation == self._generation:
+            try:
+                self._queue.put((generation, sentences), timeout=self.poll_interval)
+                self._idle.clear()
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _enqueue_each(self, sentences: Iterable[str]) -> int:
+        count = 0
+        generation = self._generation
+        for sentence in sentences:
+            if not self._put(generation, [sentence]):
+                break
+            count += 1
+        return count
+
+    def speak(self, text: str) -> int:
+        """Queue a whole response. Returns the number of sentences queued."""
+        sentences = split_sentences(text)
+        if not sentences or not self._put(self._generation, sentences):
+            return 0
+        return len(sentences)
+
+    def feed(self, chunk: str) -> int:
+        """Queue any sentences completed by a streamed chunk (blocks while the queue is full)."""
+        with self._lock:
+            sentences = self._stream.feed(chunk)
+        return self._enqueue_each(sentences)
+
+    def end_stream(self) -> int:
+        """Queue whatever is left of a streamed answer."""
+        with self._lock:
+            sentences = self._stream.flush()
+        return self._enqueue_each(sentences)
+
+    def skip(self):
+        self.driver.stop()
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            self._stream = SentenceBuffer()
+        try:
+            while True:
+                self._queue.get_nowait()
+                self._queue.task_done()
+        except queue.Empty:
+            pass
+        self.driver.stop()
+        if self._queue.empty():
+            self._idle.set()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        return self._idle.wait(timeout)
+
+    def close(self, timeout: float = 2.0):
+        if self._closed:
+            return
+        self.cancel()
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+
 class VoiceEngine:
     def __init__(self):
         if not HAS_VOICE:
@@ -17,24 +210,72 @@ class VoiceEngine:
         self.recognizer = sr.Recognizer()
         self.tts = pyttsx3.init()
         self.tts.setProperty("rate", 170)
+        self.speech = SpeechQueue(Pyttsx3Driver(self.tts))
+        self._calibrated = False
+        self.pipeline = None
 
     def listen(self) -> str:
         try:
             with sr.Microphone() as source:
-                self.recognizer.adjust_for_ambient_noise(source)
+                if not self._calibrated:
+                    # One-time calibration; dynamic_energy_threshold keeps adapting afterwards.
+                    self.recognizer.adjust_for_ambient_noise(source)
+                    self._calibrated = True
                 audio = self.recognizer.listen(source)
             return self.recognizer.recognize_google(audio)
         except Exception as e:
             logger.exception("Voice listen failed: %s", e)
             return ""
 
-    def _speak_thread(self, text: str):
-        try:
-            self.tts.say(text)
-            self.tts.runAndWait()
-        except Exception:
-            logger.exception("TTS speak failed")
+    def start_listening(self, backend=None, source=None, on_transcript: Optional[Callable] = None):
+        """
+        Start the continuous capture pipeline (see core.voice_input).
+        Defaults to the microphone and the Google backend; pass an offline backend
+        (e.g. VoskRecognizer) or a WavSource to avoid network/microphone.
+        """
+        from .voice_input import GoogleRecognizer, MicrophoneSource, VoicePipeline
+        self.stop_listening()
+        self.pipeline = VoicePipeline(
+            source or MicrophoneSource(),
+            backend or GoogleRecognizer(),
+            on_transcript=on_transcript,
+        ).start()
+        return self.pipeline
+
+    def stop_listening(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
 
     def speak(self, text: str):
-        thread = threading.Thread(target=self._speak_thread, args=(text,), daemon=True)
-        thread.start()
+        self.speech.speak(text)
+
+    def speak_stream(self, chunks: Iterable[str]):
+        """Speak a streamed answer, starting as soon as the first sentence completes."""
+        for chunk in chunks:
+            self.speech.feed(chunk)
+        self.speech.end_stream()
+
+    def cancel(self):
+        self.speech.cancel()
+
+    def skip(self):
+        self.speech.skip()
+
+
+_voice_engine: Optional[VoiceEngine] = None
+_voice_lock = threading.Lock()
+
+
+def get_voice_engine() -> Optional[VoiceEngine]:
+    """
+    Process-wide VoiceEngine (one TTS worker per process), or None if voice is unavailable.
+    """
+    global _voice_engine
+    with _voice_lock:
+        if _voice_engine is None and HAS_VOICE:
+            try:
+                _voice_engine = VoiceEngine()
+            except Exception:
+                logger.exception("Failed to initialise voice engine")
+        return _voice_engine
@@ -0,0 +1,434 @@
+"""
+Continuous voice input: audio source -> energy VAD -> utterance queue -> recognizer worker.
+Backends are pluggable; WAV files can stand in for a microphone so latency can be
+measured offline. Run `python -m core.voice_input speech.wav [--vosk-model DIR]`.
+"""
+import json
+import logging
+import math
+import queue
+import sys
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
+
+try:
+    import pyaudio
+    HAS_PYAUDIO = True
+except Exception:
+    HAS_PYAUDIO = False
+
+try:
+    import vosk
+    HAS_VOSK = True
+except Exception:
+    HAS_VOSK = False
+
+try:
+    from faster_whisper import WhisperModel
+    HAS_WHISPER = True
+except Exception:
+    HAS_WHISPER = False
+
+try:
+    import speech_recognition as sr
+    HAS_SR = True
+except Exception:
+    HAS_SR = False
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WIDTH = 2  # 16-bit PCM, mono
+
+
+def frame_rms(frame: bytes) -> float:
+    samples = array("h")
+    samples.frombytes(frame[: len(frame) - len(frame) % SAMPLE_WIDTH])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+@dataclass
+class Utterance:
+    audio: bytes
+    sample_rate: int
+    start: float  # seconds from the beginning of the stream
+    end: float
+    ready_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class Transcript:
+    text: str
+    utterance: Utterance
+    latency: float  # seconds from end of speech (segment ready) to text ready
+
+
+# ---------- audio sources ----------
+
+class AudioSource(ABC):
+    sample_rate: int = 16000
+    frame_ms: int = 30
+
+    @abstractmethod
+    def frames(self) -> Iterator[bytes]:
+        """Yield mono 16-bit PCM frames of `frame_ms` milliseconds."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WavSource(AudioSource):
+    """
+    Reads a mono 16-bit WAV file. With realtime=True frames are paced like a live microphone.
+    """
+
+    def __init__(self, path: str, frame_ms: int = 30, realtime: bool = False):
+        self.path = path
+        self.frame_ms = frame_ms
+        self.realtime = realtime
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() != SAMPLE_WIDTH or w.getnchannels() != 1:
+                raise ValueError("WavSource expects mono 16-bit PCM audio.")
+            self.sample_rate = w.getframerate()
+
+    def frames(self) -> Iterator[bytes]:
+        per_frame = int(self.sample_rate * self.frame_ms / 1000)
+        started = time.monotonic()
+        with wave.open(self.path, "rb") as w:
+            i = 0
+            while True:
+                data = w.readframes(per_frame)
+                if not data:
+                    return
+                if self.realtime:
+                    delay = started + i * self.frame_ms / 1000 - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                i += 1
+                yield data
+
+
+class MicrophoneSource(AudioSource):
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 30, device_index: Optional[int] = None):
+        if not HAS_PYAUDIO:
+            raise RuntimeError("pyaudio is not installed; microphone capture is unavailable.")
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            format=pyaudio.paInt16, channels=1, rate=sample_rate, input=True,
+            frames_per_buffer=int(sample_rate * frame_ms / 1000), input_device_index=device_index,
+        )
+        self._closed = False
+
+    def frames(self) -> Iterator[bytes]:
+        per_frame = int(self.sample_rate * self.frame_ms / 1000)
+        while not self._closed:
+            yield self._stream.read(per_frame, exception_on_overflow=False)
+
+    def close(self):
+        if self._closed and self._pa is None:
+            return
+        self._closed = True
+        pa, self._pa = self._pa, None
+        try:
+            self._stream.stop_stream()
+            self._stream.close()
+        finally:
+            pa.terminate()
+
+
+# ---------- voice activity detection ----------
+
+class EnergyVAD:
+    """
+    Energy-based voice activity detector.
+    Calibrates the noise floor once from the first `calibration_ms` of audio, then
+    keeps tracking it (exponential moving average) on frames classified as silence.
+    """
+
+    def __init__(self, sample_rate: int, frame_ms: int = 30, calibration_ms: int = 500,
+                 threshold_ratio: float = 3.0, min_threshold: float = 200.0,
+                 start_ms: int = 90, silence_ms: int = 600, padding_ms: int = 150,
+                 max_utterance_s: float = 15.0, adapt_rate: float = 0.05):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.calibration_frames = max(1, calibration_ms // frame_ms)
+        self.threshold_ratio = threshold_ratio
+        self.min_threshold = min_threshold
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.padding_frames = max(0, padding_ms // frame_ms)
+        self.max_frames = int(max_utterance_s * 1000 / frame_ms)
+        self.adapt_rate = adapt_rate
+
+        self.noise_floor: Optional[float] = None
+        self._calib: List[float] = []
+        self._frame_index = 0
+        self._history: List[bytes] = []
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._speech: Optional[List[bytes]] = None
+        self._speech_start = 0
+
+    @property
+    def threshold(self) -> float:
+        return max(self.min_threshold, (self.noise_floor or 0.0) * self.threshold_ratio)
+
+    def _seconds(self, frame_index: int) -> float:
+        return frame_index * self.frame_ms / 1000
+
+    def process(self, frame: bytes) -> Optional[Utterance]:
+        """Feed one frame; returns an Utterance when one has just ended."""
+        idx = self._frame_index
+        self._frame_index += 1
+        energy = frame_rms(frame)
+
+        if self.noise_floor is None:
+            self._calib.append(energy)
+            if len(self._calib) >= self.calibration_frames:
+                self.noise_floor = sorted(self._calib)[len(self._calib) // 2]
+            return None
+
+        voiced = energy > self.threshold
+        if self._speech is None:
+            self._history.append(frame)
+            if len(self._history) > self.padding_frames + self.start_frames:
+                self._history.pop(0)
+            if voiced:
+                self._voiced_run += 1
+                if self._voiced_run >= self.start_frames:
+                    self._speech = list(self._history)
+                    self._speech_start = idx + 1 - len(self._history)
+                    self._history = []
+                    self._silent_run = 0
+            else:
+                self._voiced_run = 0
+                self.noise_floor += self.adapt_rate * (energy - self.noise_floor)
+            return None
+
+        self._speech.append(frame)
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.silence_frames or len(self._speech) >= self.max_frames:
+            return self._finish(idx + 1)
+        return None
+
+    def _finish(self, end_index: int) -> Utterance:
+        frames = self._speech or []
+        trailing = max(self._silent_run - self.padding_frames, 0)
+        if trailing:
+            frames = frames[:-trailing]
+        utt = Utterance(
+            audio=b"".join(frames),
+            sample_rate=self.sample_rate,
+            start=self._seconds(self._speech_start),
+            end=self._seconds(end_index - trailing),
+        )
+        self._speech = None
+        self._voiced_run = 0
+        self._silent_run = 0
+        return utt
+
+    def flush(self) -> Optional[Utterance]:
+        if self._speech:
+            return self._finish(self._frame_index)
+        return None
+
+
+# ---------- recognizer backends ----------
+
+class RecognizerBackend(ABC):
+    @abstractmethod
+    def transcribe(self, audio: bytes, sample_rate: int) -> str:
+        raise NotImplementedError
+
+
+class VoskRecognizer(RecognizerBackend):
+    """Offline recognizer using a local Vosk model directory."""
+
+    def __init__(self, model_path: str):
+        if not HAS_VOSK:
+            raise RuntimeError("vosk is not installed. Install it or use a different backend.")
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, audio: bytes, sample_rate: int) -> str:
+        rec = vosk.KaldiRecognizer(self.model, sample_rate)
+        rec.AcceptWaveform(audio)
+        return json.loads(rec.FinalResult()).get("text", "")
+
+
+class WhisperRecognizer(RecognizerBackend):
+    """Offline recognizer using faster-whisper."""
+
+    def __init__(self, model_name: str = "base.en", device: str = "cpu", compute_type: str = "int8"):
+        if not HAS_WHISPER:
+            raise RuntimeError("faster-whisper is not installed. Install it or use a different backend.")
+        self.model = WhisperModel(model_name, device=device, compute_type=compute_type)
+
+    def transcribe(self, audio: bytes, sample_rate: int) -> str:
+        if sample_rate != 16000:
+            raise ValueError("WhisperRecognizer expects 16 kHz audio.")
+        samples = array("h")
+        samples.frombytes(audio)
+        floats = [s / 32768.0 for s in samples]
+        try:
+            import numpy as np
+            floats = np.asarray(floats, dtype=np.float32)
+        except ImportError:
+            pass
+        segments, _ = self.model.transcribe(floats, beam_size=1)
+        return " ".join(seg.text.strip() for seg in segments).strip()
+
+
+class GoogleRecognizer(RecognizerBackend):
+    """Online recognizer via speech_recognition (network round trip per utterance)."""
+
+    def __init__(self):
+        if not HAS_SR:
+            raise RuntimeError("speech_recognition is not installed.")
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, audio: bytes, sample_rate: int) -> str:
+        try:
+            return self.recognizer.recognize_google(sr.AudioData(audio, sample_rate, SAMPLE_WIDTH))
+        except sr.UnknownValueError:
+            return ""
+
+
+# ---------- pipeline ----------
+
+class VoicePipeline:
+    """
+    Background capture thread (source -> VAD -> utterance queue) plus a recognizer
+    worker thread (utterance queue -> backend -> transcript queue).
+    """
+
+    def __init__(self, source: AudioSource, backend: RecognizerBackend, vad: Optional[EnergyVAD] = None,
+                 on_transcript: Optional[Callable[[Transcript], None]] = None, max_pending: int = 8):
+        self.source = source
+        self.backend = backend
+        self.vad = vad or EnergyVAD(source.sample_rate, frame_ms=source.frame_ms)
+        self.on_transcript = on_transcript
+        self.utterances: "queue.Queue[Optional[Utterance]]" = queue.Queue(maxsize=max_pending)
+        self.transcripts: "queue.Queue[Optional[Transcript]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "VoicePipeline":
+        self._threads = [
+            threading.Thread(target=self._capture, name="jarvis-voice-capture", daemon=True),
+            threading.Thread(target=self._recognize, name="jarvis-voice-asr", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def _emit(self, utt: Utterance):
+        while not self._stop.is_set():
+            try:
+                self.utterances.put(utt, timeout=0.5)
+                return
+            except queue.Full:
+                logger.warning("Recognizer is falling behind; utterance queue is full.")
+
+    def _capture(self):
+        try:
+            for frame in self.source.frames():
+                if self._stop.is_set():
+                    break
+                utt = self.vad.process(frame)
+                if utt is not None:
+                    self._emit(utt)
+            utt = self.vad.flush()
+            if utt is not None:
+                self._emit(utt)
+        except Exception:
+            logger.exception("Voice capture failed")
+        finally:
+            # Closed here, on the thread that reads it: PortAudio does not allow closing
+            # a stream from another thread while read() is blocked on it.
+            try:
+                self.source.close()
+            except Exception:
+                logger.exception("Closing the audio source failed")
+            self.utterances.put(None)
+
+    def _recognize(self):
+        while True:
+            utt = self.utterances.get()
+            if utt is None:
+                self.transcripts.put(None)
+                return
+            try:
+                text = self.backend.transcribe(utt.audio, utt.sample_rate)
+            except Exception:
+                logger.exception("Speech recognition failed")
+                text = ""
+            tr = Transcript(text=text, utterance=utt, latency=time.monotonic() - utt.ready_at)
+            if self.on_transcript is not None:
+                try:
+                    self.on_transcript(tr)
+                except Exception:
+                    logger.exception("on_transcript callback failed")
+            self.transcripts.put(tr)
+
+    def __iter__(self) -> Iterator[Transcript]:
+        while True:
+            tr = self.transcripts.get()
+            if tr is None:
+                return
+            yield tr
+
+    def stop(self, timeout: float = 2.0):
+        """Signal the threads to finish; the capture thread closes the source itself."""
+        self._stop.set()
+        if not self._threads:
+            self.source.close()
+            return
+        for t in self._threads:
+            t.join(timeout)
+            if t.is_alive():
+                logger.warning("%s did not stop within %.1fs", t.name, timeout)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    class _DurationBackend(RecognizerBackend):
+        def transcribe(self, audio: bytes, sample_rate: int) -> str:
+            return f"<{len(audio) / SAMPLE_WIDTH / sample_rate:.2f}s of speech>"
+
+    parser = argparse.ArgumentParser(description="Measure per-utterance latency on a WAV file.")
+    parser.add_argument("wav")
+    parser.add_argument("--vosk-model", default="")
+    parser.add_argument("--whisper-model", default="")
+    parser.add_argument("--realtime", action="store_true")
+    args = parser.parse_args()
+
+    if args.vosk_model:
+        backend: RecognizerBackend = VoskRecognizer(args.vosk_model)
+    elif args.whisper_model:
+        backend = WhisperRecognizer(args.whisper_model)
+    else:
+        backend = _DurationBackend()
+    pipeline = VoicePipeline(WavSource(args.wav, realtime=args.realtime), backend).start()
+    latencies = []
+    for tr in pipeline:
+        latencies.append(tr.latency)
+        print(f"[{tr.utterance.start:6.2f}-{tr.utterance.end:6.2f}s] {tr.latency * 1000:7.1f} ms  {tr.text}")
+    if latencies:
+        print(f"utterances={len(latencies)} mean={sum(latencies) / len(latencies) * 1000:.1f} ms "
+              f"max={max(latencies) * 1000:.1f} ms")